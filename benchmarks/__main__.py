@@ -0,0 +1,98 @@
+"""
+Run the benchmark suite
+
+Usage:
+    python -m benchmarks [--suite sql,data,projects,routes] [--sizes 1000,100000]
+                         [--seed 0] [--repeat 5] [--output results.json]
+                         [--compare baseline.json] [--threshold 0.1] [--metric median]
+
+Sizes accept k/M suffixes (e.g. 1k,100k,10M). Results are written as JSON.
+With --compare, every benchmark is matched against the same name and size
+in the baseline file, and the exit status is 1 if any of them got slower
+than the threshold allows.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+from .harness import compare, format_seconds, load_results, measure, write_results
+from .suites import SUITES
+
+
+def parse_size(text):
+    text = text.strip()
+    multipliers = {"k": 1000, "m": 1000000}
+    suffix = text[-1:].lower()
+    if suffix in multipliers:
+        return int(float(text[:-1]) * multipliers[suffix])
+    return int(text)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Run the benchmark suite")
+    parser.add_argument("--suite", default=",".join(SUITES),
+                        help=f"Comma-separated suites to run (default: {','.join(SUITES)})")
+    parser.add_argument("--sizes", default="1k,10k,100k",
+                        help="Comma-separated row counts, 1k to 10M (default: 1k,10k,100k)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the data generators")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repeats per benchmark")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this text")
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON file to write results to")
+    parser.add_argument("--compare", metavar="BASELINE", help="Baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative slowdown counted as a regression (default: 0.1)")
+    parser.add_argument("--metric", choices=("median", "min"), default="median",
+                        help="Timing compared against the baseline")
+    args = parser.parse_args(argv)
+    args.suites = [name.strip() for name in args.suite.split(",") if name.strip()]
+    unknown = [name for name in args.suites if name not in SUITES]
+    if unknown:
+        parser.error(f"Unknown suite(s): {', '.join(unknown)}. Use: {', '.join(SUITES)}")
+    # Every size is run once; the suites keep one database per size in the work directory
+    args.size_list = list(dict.fromkeys(parse_size(size) for size in args.sizes.split(",") if size.strip()))
+    if args.compare and not os.path.isfile(args.compare):
+        parser.error(f"Baseline file not found: {args.compare}")
+    return args
+
+
+def run(args):
+    results = []
+    with tempfile.TemporaryDirectory(prefix="benchmarks-") as workdir:
+        for size in args.size_list:
+            for suite_name in args.suites:
+                for bench_case in SUITES[suite_name](size, args.seed, workdir):
+                    if args.filter not in bench_case.name:
+                        continue
+                    timing = measure(bench_case, args.repeat)
+                    result = dict(name=bench_case.name, size=size, **timing)
+                    results.append(result)
+                    print(f"{bench_case.name:<45} {size:>9}  median {format_seconds(timing['median']):>10}"
+                          f"  min {format_seconds(timing['min']):>10}", flush=True)
+    return results
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    # Read the baseline before spending the whole run on results that can't be compared
+    baseline = load_results(args.compare) if args.compare else None
+    results = run(args)
+    options = {"suites": args.suites, "sizes": args.size_list, "seed": args.seed, "repeat": args.repeat}
+    write_results(args.output, results, options)
+    print(f"\nWrote {len(results)} results to {args.output}")
+
+    if not args.compare:
+        return 0
+    rows = compare(results, baseline, args.threshold, args.metric)
+    print(f"\nCompared with {args.compare} ({args.metric}, threshold {args.threshold:.0%}):")
+    for key, before, after, ratio, status in rows:
+        change = f"{ratio:6.2f}x" if ratio is not None else "      -"
+        marker = {"regression": "  <-- REGRESSION", "improvement": "  (faster)"}.get(status, "")
+        print(f"  {key:<55} {format_seconds(before):>10} -> {format_seconds(after):>10} {change}{marker}")
+    regressions = sum(1 for row in rows if row[4] == "regression")
+    print(f"\n{regressions} regression(s)")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
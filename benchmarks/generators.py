@@ -0,0 +1,77 @@
+"""
+Seeded synthetic data for the benchmarks
+
+The same (count, seed) always produces the same rows, so results from
+different runs and machines are comparable. Rows are generated lazily, so
+multi-million row tables can be streamed into SQLite without holding them
+in memory.
+"""
+import random
+
+CATEGORIES = (
+    "Electronics", "Furniture", "Kitchenware", "Clothing", "Books",
+    "Toys", "Garden", "Sports", "Beauty", "Automotive",
+)
+# Skewed category sizes, as in a real catalog
+CATEGORY_WEIGHTS = (30, 15, 12, 10, 9, 8, 6, 5, 3, 2)
+
+_ADJECTIVES = ("Smart", "Classic", "Compact", "Deluxe", "Portable", "Ergonomic", "Wireless", "Vintage")
+_NOUNS = ("Lamp", "Chair", "Phone", "Mug", "Desk", "Speaker", "Jacket", "Kettle", "Drone", "Novel")
+_FIRST_NAMES = ("John", "Jane", "Alice", "Bob", "Charlie", "Dana", "Eve", "Frank", "Grace", "Heidi")
+_LAST_NAMES = ("Doe", "Smith", "Jones", "Brown", "Wilson", "Taylor", "Lee", "Walker", "Young", "King")
+_DOMAINS = ("example.com", "mail.example.org", "test.example.net")
+
+PRODUCT_COLUMNS = ("id", "name", "category", "price", "inventory")
+USER_COLUMNS = ("id", "username", "password", "email", "is_admin", "credit_card")
+
+
+def generate_products(count, seed=0):
+    """
+    Yield count product dictionaries with id, name, category, price and inventory
+
+    About 2% of the products have a price of 0, which the analysis code filters out.
+    """
+    rng = random.Random(seed)
+    categories = rng.choices(CATEGORIES, CATEGORY_WEIGHTS, k=count)
+    for index in range(count):
+        price = 0.0 if rng.random() < 0.02 else round(rng.lognormvariate(3.5, 1.0), 2)
+        yield {
+            "id": index + 1,
+            "name": f"{rng.choice(_ADJECTIVES)} {rng.choice(_NOUNS)} {index}",
+            "category": categories[index],
+            "price": price,
+            "inventory": rng.randrange(0, 500),
+        }
+
+
+def generate_users(count, seed=0):
+    """
+    Yield count user dictionaries
+
+    Names contain irregular whitespace and about 10% of the email addresses are
+    invalid, so the cleaning and validation paths of process_user_data do real work.
+    """
+    rng = random.Random(seed)
+    for index in range(count):
+        first, last = rng.choice(_FIRST_NAMES), rng.choice(_LAST_NAMES)
+        username = f"{first.lower()}_{last.lower()}{index}"
+        if rng.random() < 0.1:
+            email = f"{username}@{rng.choice(('example', 'invalid', 'no-tld'))}"
+        else:
+            email = f"{username}@{rng.choice(_DOMAINS)}"
+        yield {
+            "id": index + 1,
+            "name": f"{first}{' ' * rng.randint(1, 4)}{last}",
+            "username": username,
+            "password": f"pw{rng.getrandbits(32):08x}",
+            "email": email,
+            "age": rng.randint(10, 80),
+            "is_admin": int(rng.random() < 0.01),
+            "credit_card": f"XXXX-XXXX-XXXX-{rng.randrange(10000):04d}",
+        }
+
+
+def as_rows(records, columns):
+    """Turn dictionaries into tuples in column order, e.g. for bulk_load"""
+    for record in records:
+        yield tuple(record[column] for column in columns)
@@ -0,0 +1,124 @@
+"""
+Timing, result files and baseline comparison for the benchmark suite
+"""
+import gc
+import json
+import platform
+import sqlite3
+import statistics
+import sys
+import time
+from collections import namedtuple
+
+# One benchmark: setup() runs untimed before every repeat and returns the arguments
+# for run(*args), which is timed number times in a row
+Case = namedtuple("Case", ["name", "run", "setup", "number"])
+
+
+def case(name, run, setup=None, number=1):
+    """Create a Case; without setup, run is called without arguments"""
+    return Case(name, run, setup, number)
+
+
+def measure(bench_case, repeat=5):
+    """
+    Time a Case
+
+    Garbage collection is disabled while timing so collections triggered by
+    earlier cases do not land in this one.
+
+    Returns:
+        Dictionary with per-call min, median, mean and stdev in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        args = bench_case.setup() if bench_case.setup is not None else ()
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            for _ in range(bench_case.number):
+                bench_case.run(*args)
+            elapsed = time.perf_counter() - started
+        finally:
+            gc.enable()
+        timings.append(elapsed / bench_case.number)
+    return {
+        "number": bench_case.number,
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+def environment():
+    """Describe the machine and library versions a result file was recorded with"""
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def result_key(result):
+    return f"{result['name']}[{result['size']}]"
+
+
+def write_results(path, results, options):
+    """Write results with the environment and run options as JSON"""
+    with open(path, "w", encoding="utf-8") as result_file:
+        json.dump({"environment": environment(), "options": options, "results": results},
+                  result_file, indent=2)
+        result_file.write("\n")
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as result_file:
+        return json.load(result_file)["results"]
+
+
+def compare(results, baseline, threshold=0.1, metric="median"):
+    """
+    Compare results against a baseline run
+
+    Parameters:
+        results: Results of the current run
+        baseline: Results of the baseline run
+        threshold: Relative slowdown (0.1 = 10%) above which a benchmark counts as a regression
+        metric: Timing compared, "min" or "median"
+
+    Returns:
+        List of (key, baseline seconds, current seconds, ratio, status) rows, where status is
+        "regression", "improvement", "same" or "new"
+    """
+    baseline_by_key = {result_key(result): result for result in baseline}
+    rows = []
+    for result in results:
+        key = result_key(result)
+        previous = baseline_by_key.get(key)
+        if previous is None:
+            rows.append((key, None, result[metric], None, "new"))
+            continue
+        ratio = result[metric] / previous[metric] if previous[metric] else float("inf")
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "same"
+        rows.append((key, previous[metric], result[metric], ratio, status))
+    return rows
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
@@ -0,0 +1,346 @@
+"""
+Open-loop HTTP load generator for the Flask apps
+
+Starts the apps on local sockets in child processes, with size generated
+products and users, and drives them with a request mix arriving at a fixed
+rate (Poisson arrivals) regardless of how fast responses come back. Because
+latency is measured from each request's scheduled start, time spent waiting
+for a free client worker counts too, and overload shows up as growing tail
+latency instead of being hidden (no coordinated omission).
+
+Usage:
+    python -m benchmarks.loadtest [--server threaded,processes,prefork] [--rate 200] [--duration 10]
+                                  [--concurrency 32] [--mix products=0.8,users_search=0.2]
+                                  [--size 10000] [--output loadtest.json]
+
+--rate 0 switches to closed-loop mode: every client worker sends its next
+request as soon as the previous one completes.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+# Target name -> (app, path)
+TARGETS = {
+    "products": ("secure", "/api/products?limit=100"),
+    "products_next_page": ("secure", "/api/products?limit=100&after=WzUwLjAsIDBd"),
+    "products_category": ("secure", "/api/products?category=Electronics&min_price=10&max_price=500&limit=100"),
+    "products_by_category": ("secure", "/api/products/by-category?category=Books&limit=100"),
+    "users_search": ("vulnerable", "/api/users/search?condition=id%20%3D%2042"),
+}
+
+APPS = {
+    "secure": ("project1/secure_app.py", "SECURE_APP_DB"),
+    "vulnerable": ("project2/vulnerable_app.py", "VULNERABLE_APP_DB"),
+}
+
+# Server implementations a scenario can run against: werkzeug's threaded and
+# forking servers, and lib.serving's prefork workers with threads
+SERVERS = ("threaded", "processes", "prefork")
+
+
+def serve(app_name, server, port, size, seed, workers):
+    """Child process entry point: load data and serve one app until terminated"""
+    from werkzeug.serving import make_server
+    from .generators import PRODUCT_COLUMNS, USER_COLUMNS, as_rows, generate_products, generate_users
+    from .suites import _reset_table, load_project_module
+    from lib.serving import serve_prefork
+
+    path, db_variable = APPS[app_name]
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ[db_variable] = os.path.join(workdir, f"{app_name}.db")
+    module = load_project_module(f"{app_name}_app", path)
+    module.initialize_database()
+    if app_name == "secure":
+        _reset_table(module.DB_PATH, "products", PRODUCT_COLUMNS,
+                     as_rows(generate_products(size, seed), PRODUCT_COLUMNS))
+    else:
+        _reset_table(module.DB_PATH, "users", USER_COLUMNS, as_rows(generate_users(size, seed), USER_COLUMNS))
+
+    # Per-request access logging would dominate the measurements
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    # Turn terminate() from the load generator into a normal exit so the data is cleaned up
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    owner = os.getpid()
+    try:
+        if server == "prefork":
+            # The database is already set up, so nothing runs before the fork
+            serve_prefork(module.create_app, port=port, workers=workers)
+        else:
+            options = {"threaded": True} if server == "threaded" else {"processes": workers}
+            make_server("127.0.0.1", port, module.app, **options).serve_forever()
+    finally:
+        if os.getpid() == owner:  # not in a forked request handler
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(app_name, server, size, seed, workers, timeout=120.0):
+    """Start an app server in a child process and wait until /health answers"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.loadtest", "--serve", app_name, "--server", server,
+         "--port", str(port), "--size", str(size), "--seed", str(seed), "--workers", str(workers)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{app_name} server exited with status {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{app_name} server did not come up within {timeout} seconds")
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def parse_mix(text):
+    """Parse 'products=0.8,users_search=0.2' into normalized (target, weight) pairs"""
+    mix = []
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in TARGETS:
+            raise ValueError(f"Unknown target '{name}'. Use one of: {', '.join(TARGETS)}")
+        mix.append((name, float(weight or 1)))
+    total = sum(weight for _, weight in mix)
+    if total <= 0:
+        raise ValueError("The request mix needs a positive weight")
+    return [(name, weight / total) for name, weight in mix]
+
+
+class _Worker(threading.Thread):
+    """Client thread with one keep-alive connection per app"""
+
+    def __init__(self, ports, schedule, records, timeout):
+        super().__init__(daemon=True)
+        self.ports = ports
+        self.schedule = schedule
+        self.records = records
+        self.timeout = timeout
+        self.connections = {}
+
+    def _connection(self, app_name):
+        conn = self.connections.get(app_name)
+        if conn is None:
+            conn = http.client.HTTPConnection("127.0.0.1", self.ports[app_name], timeout=self.timeout)
+            self.connections[app_name] = conn
+        return conn
+
+    def run(self):
+        while True:
+            item = self.schedule.get()
+            if item is None:
+                break
+            scheduled, target = item
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            app_name, path = TARGETS[target]
+            started = time.perf_counter()
+            try:
+                conn = self._connection(app_name)
+                conn.request("GET", path)
+                response = conn.getresponse()
+                response.read()
+                outcome = "ok" if response.status < 400 else f"http_{response.status}"
+                if response.getheader("Connection", "").lower() == "close":
+                    conn.close()
+                    self.connections.pop(app_name, None)
+            except socket.timeout:
+                outcome = "timeout"
+                self._drop(app_name)
+            except (OSError, http.client.HTTPException):
+                outcome = "connection_error"
+                self._drop(app_name)
+            finished = time.perf_counter()
+            # (target, outcome, latency from the scheduled start, service time)
+            self.records.append((target, outcome, finished - (scheduled or started), finished - started))
+        for conn in self.connections.values():
+            conn.close()
+
+    def _drop(self, app_name):
+        conn = self.connections.pop(app_name, None)
+        if conn is not None:
+            conn.close()
+
+
+def run_scenario(ports, mix, rate, duration, concurrency, seed=0, timeout=10.0):
+    """
+    Drive the servers with one scenario
+
+    Returns:
+        Summary dictionary with throughput, latency percentiles and error counts
+    """
+    rng = random.Random(seed)
+    targets = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    schedule = queue.Queue()
+    records = []
+    workers = [_Worker(ports, schedule, records, timeout) for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+
+    started = time.perf_counter()
+    end = started + duration
+    if rate > 0:
+        # Open loop: Poisson arrivals at the offered rate, independent of response times
+        scheduled = started
+        while True:
+            scheduled += rng.expovariate(rate)
+            if scheduled >= end:
+                break
+            schedule.put((scheduled, rng.choices(targets, weights)[0]))
+            # Keep the schedule only slightly ahead of the clock
+            ahead = scheduled - time.perf_counter() - 0.05
+            if ahead > 0:
+                time.sleep(ahead)
+    else:
+        # Closed loop: keep every worker busy until the duration is over
+        while time.perf_counter() < end:
+            while schedule.qsize() < concurrency:
+                schedule.put((0, rng.choices(targets, weights)[0]))
+            time.sleep(0.001)
+    for _ in workers:
+        schedule.put(None)
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    return summarize(records, elapsed, rate, duration, concurrency)
+
+
+def summarize(records, elapsed, rate, duration, concurrency):
+    outcomes = Counter(outcome for _, outcome, _, _ in records)
+    latencies = sorted(latency for _, outcome, latency, _ in records if outcome == "ok")
+    service = sorted(service for _, outcome, _, service in records if outcome == "ok")
+    per_target = {}
+    for target in sorted({target for target, _, _, _ in records}):
+        target_latencies = sorted(latency for name, outcome, latency, _ in records
+                                  if name == target and outcome == "ok")
+        per_target[target] = {
+            "requests": sum(1 for name, _, _, _ in records if name == target),
+            "p50": percentile(target_latencies, 0.5),
+            "p99": percentile(target_latencies, 0.99),
+        }
+    total = len(records)
+    return {
+        "offered_rate": rate,
+        "duration": duration,
+        "concurrency": concurrency,
+        "requests": total,
+        "throughput": outcomes["ok"] / elapsed if elapsed else 0.0,
+        "error_rate": (total - outcomes["ok"]) / total if total else 0.0,
+        "outcomes": dict(outcomes),
+        "latency": {"p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99),
+                    "p999": percentile(latencies, 0.999), "max": latencies[-1] if latencies else None},
+        "service_time": {"p50": percentile(service, 0.5), "p99": percentile(service, 0.99),
+                         "p999": percentile(service, 0.999)},
+        "targets": per_target,
+    }
+
+
+def _ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f} ms"
+
+
+def print_summary(server, summary):
+    latency = summary["latency"]
+    print(f"\n[{server}] {summary['requests']} requests, {summary['throughput']:.1f} req/s ok, "
+          f"error rate {summary['error_rate']:.2%} {summary['outcomes']}")
+    print(f"  latency  p50 {_ms(latency['p50'])}  p99 {_ms(latency['p99'])}  "
+          f"p999 {_ms(latency['p999'])}  max {_ms(latency['max'])}")
+    service = summary["service_time"]
+    print(f"  service  p50 {_ms(service['p50'])}  p99 {_ms(service['p99'])}  p999 {_ms(service['p999'])}")
+    for target, stats in summary["targets"].items():
+        print(f"  {target:<22} {stats['requests']:>7} requests  p50 {_ms(stats['p50'])}  p99 {_ms(stats['p99'])}")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadtest", description="Open-loop HTTP load test")
+    parser.add_argument("--server", default="threaded,processes",
+                        help=f"Comma-separated servers to compare: {', '.join(SERVERS)}")
+    parser.add_argument("--rate", type=float, default=200.0,
+                        help="Offered requests per second (0 for closed loop)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to send requests for")
+    parser.add_argument("--concurrency", type=int, default=32, help="Client worker threads")
+    parser.add_argument("--mix", default="products=0.6,products_category=0.2,users_search=0.2",
+                        help=f"Comma-separated target=weight pairs; targets: {', '.join(TARGETS)}")
+    parser.add_argument("--size", type=int, default=10000, help="Generated products/users per app")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes of the multi-process servers")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Per-request timeout in seconds")
+    parser.add_argument("--output", help="JSON file to write the summaries to")
+    parser.add_argument("--serve", choices=tuple(APPS), help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.serve:
+        serve(args.serve, args.server, args.port, args.size, args.seed, args.workers)
+        return 0
+
+    mix = parse_mix(args.mix)
+    servers = [name.strip() for name in args.server.split(",") if name.strip()]
+    unknown = [name for name in servers if name not in SERVERS]
+    if unknown:
+        raise SystemExit(f"Unknown server(s): {', '.join(unknown)}. Use: {', '.join(SERVERS)}")
+    apps = sorted({TARGETS[name][0] for name, _ in mix})
+
+    summaries = {}
+    for server in servers:
+        processes, ports = [], {}
+        try:
+            for app_name in apps:
+                process, ports[app_name] = start_server(app_name, server, args.size, args.seed, args.workers)
+                processes.append(process)
+            summaries[server] = run_scenario(ports, mix, args.rate, args.duration, args.concurrency,
+                                             args.seed, args.timeout)
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+        print_summary(server, summaries[server])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"mix": dict(mix), "size": args.size, "servers": summaries}, output_file, indent=2)
+            output_file.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+Benchmark suites
+
+Each suite is a generator function taking (size, seed, workdir) and yielding
+Cases; anything it creates lives in workdir. Suites are looked up by name in
+SUITES.
+"""
+import importlib.util
+import os
+import sqlite3
+import sys
+from contextlib import contextmanager
+from operator import itemgetter
+
+from .generators import (
+    CATEGORIES, PRODUCT_COLUMNS, USER_COLUMNS, as_rows, generate_products, generate_users
+)
+from .harness import case
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from lib import sql_utils
+from lib.data_processing import (
+    Count, Mean, Pipeline, filter_data, group_by, parallel_group_by, reduce_by_key
+)
+
+_modules = {}
+
+
+def load_project_module(name, relative_path):
+    """Import a project module by path (both projects have a main.py) once per process"""
+    if name not in _modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, relative_path))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[name] = module
+    return _modules[name]
+
+
+def create_products_table(db_conn):
+    """Create the products table and indexes the way secure_app does"""
+    db_conn.execute(
+        "CREATE TABLE IF NOT EXISTS products (id INTEGER PRIMARY KEY, name TEXT NOT NULL, "
+        "category TEXT NOT NULL, price REAL NOT NULL, inventory INTEGER DEFAULT 0)"
+    )
+    db_conn.execute("CREATE INDEX IF NOT EXISTS idx_products_price ON products (price)")
+    db_conn.execute("CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category, price)")
+    db_conn.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products (category)")
+    db_conn.commit()
+
+
+def load_products(db_conn, size, seed):
+    sql_utils.bulk_load(db_conn, "products", as_rows(generate_products(size, seed), PRODUCT_COLUMNS),
+                        columns=PRODUCT_COLUMNS, rebuild_indexes=True)
+
+
+def remove_database(path):
+    """Delete a SQLite database file together with its WAL and shared-memory files"""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def sql_suite(size, seed, workdir):
+    """sql_utils query paths over a products table of size rows"""
+    def fresh_database():
+        path = os.path.join(workdir, "bulk_load.db")
+        remove_database(path)
+        conn = sql_utils.connect_to_db(path, profile="bulk_load")
+        create_products_table(conn)
+        return (conn,)
+
+    def bulk_load(conn):
+        load_products(conn, size, seed)
+        conn.close()
+
+    yield case("sql.bulk_load", bulk_load, fresh_database, number=1)
+
+    path = os.path.join(workdir, f"products-{size}.db")
+    remove_database(path)
+    conn = sql_utils.connect_to_db(path, profile="read_heavy")
+    create_products_table(conn)
+    load_products(conn, size, seed)
+    sql_utils.create_fts_index(conn, "products")
+    try:
+        category_query = ("SELECT * FROM products WHERE category = ? AND price BETWEEN ? AND ? "
+                          "ORDER BY price, id LIMIT 100")
+        yield case("sql.execute_safe_query.page", lambda: sql_utils.execute_safe_query(
+            conn, category_query, ("Furniture", 10.0, 500.0)), number=200)
+        for row_format in ("dict", "tuple", "columnar"):
+            yield case(f"sql.execute_safe_query.1k_rows.{row_format}", lambda row_format=row_format:
+                       sql_utils.execute_safe_query(conn, "SELECT * FROM products LIMIT 1000", (),
+                                                    row_format), number=20)
+
+        def stream_all():
+            for _ in sql_utils.iter_safe_query_batches(conn, "SELECT * FROM products", (),
+                                                       row_format="tuple"):
+                pass
+        yield case("sql.iter_safe_query_batches.all_rows", stream_all)
+
+        search_term = f"Lamp {size // 2}"
+        yield case("sql.search_records_safe.like", lambda: sql_utils.search_records_safe(
+            conn, "products", search_term, use_fts=False), number=5)
+        yield case("sql.search_records_safe.fts", lambda: sql_utils.search_records_safe(
+            conn, "products", search_term), number=5)
+
+        in_list_query = (sql_utils.SelectQuery("products", PRODUCT_COLUMNS)
+                         .where("category", "IN", CATEGORIES[7:])
+                         .where("price", "<", 50.0)
+                         .order_by("id")
+                         .limit(100))
+        yield case("sql.select_query.in_list", lambda: in_list_query.execute(conn), number=200)
+
+        cache = sql_utils.QueryCache(path)
+        yield case("sql.query_cache.hit", lambda: sql_utils.execute_safe_query(
+            conn, category_query, ("Furniture", 10.0, 500.0), cache=cache), number=1000)
+        cache.close()
+    finally:
+        conn.close()
+
+
+def data_suite(size, seed, workdir):
+    """lib.data_processing functions over size product dictionaries"""
+    products = list(generate_products(size, seed))
+    by_category = itemgetter("category")
+    has_price = lambda p: p["price"] > 0  # noqa: E731
+
+    yield case("data.filter_data", lambda: filter_data(products, has_price))
+    yield case("data.group_by", lambda: group_by(products, by_category))
+    yield case("data.reduce_by_key.mean", lambda: reduce_by_key(
+        products, by_category, Mean(itemgetter("price"))))
+    yield case("data.reduce_by_key.count", lambda: reduce_by_key(products, by_category, Count()))
+    yield case("data.pipeline", lambda: Pipeline(products).filter(has_price)
+               .map(itemgetter("price")).aggregate(lambda total, price: total + price, 0.0))
+    yield case("data.parallel_group_by", lambda: parallel_group_by(products, by_category), number=1)
+
+
+def projects_suite(size, seed, workdir):
+    """process_user_data and analyze_product_data on size users/products"""
+    project1 = load_project_module("project1_main", "project1/main.py")
+    project2 = load_project_module("project2_main", "project2/main.py")
+    users = list(generate_users(size, seed))
+    products = list(generate_products(size, seed))
+
+    # process_user_data cleans names in place, so every repeat gets fresh copies
+    copy_users = lambda: ([dict(user) for user in users],)  # noqa: E731
+    yield case("project1.process_user_data", project1.process_user_data, copy_users)
+    yield case("project1.count_users_by_age_group", project1.count_users_by_age_group, copy_users)
+
+    yield case("project2.analyze_product_data.python",
+               lambda: project2.analyze_product_data(products, engine="python"))
+    if project2.np is not None:
+        yield case("project2.analyze_product_data.numpy",
+                   lambda: project2.analyze_product_data(products, engine="numpy"))
+
+    path = os.path.join(workdir, f"analysis-{size}.db")
+    remove_database(path)
+    conn = sqlite3.connect(path)
+    create_products_table(conn)
+    load_products(conn, size, seed)
+    try:
+        yield case("project2.analyze_product_data.sql", lambda: project2.analyze_product_data(conn))
+    finally:
+        conn.close()
+
+
+def _reset_table(db_path, table_name, columns, rows):
+    conn = sql_utils.connect_to_db(db_path, profile="bulk_load")
+    try:
+        conn.execute(f"DELETE FROM {table_name}")
+        conn.commit()
+        sql_utils.bulk_load(conn, table_name, rows, columns=columns, rebuild_indexes=True)
+    finally:
+        conn.close()
+
+
+@contextmanager
+def _environ(**values):
+    """Set environment variables for the duration of a with block, restoring the old values after"""
+    previous = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _load_app(name, relative_path, db_variable, workdir):
+    """Import an app with its database in workdir, never in a location set by the caller's environment"""
+    # The apps read their database location at import time
+    with _environ(**{db_variable: os.path.join(workdir, f"{name}.db")}):
+        module = load_project_module(name, relative_path)
+    if os.path.dirname(os.path.abspath(module.DB_PATH)) != os.path.abspath(workdir):
+        raise RuntimeError(f"{name} was imported with database {module.DB_PATH}, outside the benchmark directory")
+    return module
+
+
+def routes_suite(size, seed, workdir):
+    """Flask routes of both apps through the test client, with size products and users"""
+    # Importing an app installs its QueryMetrics for all of sql_utils; other suites must
+    # keep running uninstrumented, so the previous metrics are restored afterwards
+    previous_metrics = sql_utils.get_query_metrics()
+    try:
+        # _reset_table empties the tables, so the databases must be the benchmark's own
+        secure_app = _load_app("secure_app", "project1/secure_app.py", "SECURE_APP_DB", workdir)
+        vulnerable_app = _load_app("vulnerable_app", "project2/vulnerable_app.py", "VULNERABLE_APP_DB", workdir)
+    finally:
+        sql_utils.set_query_metrics(previous_metrics)
+    secure_app.initialize_database()
+    vulnerable_app.initialize_database()
+    _reset_table(secure_app.DB_PATH, "products", PRODUCT_COLUMNS,
+                 as_rows(generate_products(size, seed), PRODUCT_COLUMNS))
+    _reset_table(vulnerable_app.DB_PATH, "users", USER_COLUMNS,
+                 as_rows(generate_users(size, seed), USER_COLUMNS))
+
+    secure_client = secure_app.app.test_client()
+    vulnerable_client = vulnerable_app.app.test_client()
+    # The listings are measured instrumented, as they run in the secure app's process
+    sql_utils.set_query_metrics(secure_app.query_metrics)
+    try:
+        def get(client, url, headers=None, status=200):
+            response = client.get(url, headers=headers)
+            response.get_data()
+            assert response.status_code == status, f"{url}: {response.status_code}"
+            return response
+
+        def get_uncached(url):
+            # Every call must run the query: drop the response and query caches first
+            secure_app.response_cache.invalidate()
+            secure_app.query_cache.invalidate()
+            return get(secure_client, url)
+
+        first_page = "/api/products?limit=100"
+        next_cursor = get_uncached(first_page).get_json()["next_cursor"]
+        if next_cursor is None:
+            raise RuntimeError(f"routes.api_products.next_page needs more than 100 products, got size {size}")
+        for url, name in (
+            (first_page, "routes.api_products.first_page"),
+            (f"/api/products?limit=100&after={next_cursor}", "routes.api_products.next_page"),
+            ("/api/products?category=Furniture&min_price=10&max_price=500&limit=100",
+             "routes.api_products.category_price"),
+            ("/api/products/by-category?category=Books&limit=100", "routes.api_products_by_category"),
+        ):
+            yield case(name, lambda url=url: get_uncached(url), number=50)
+
+        # Repeated polls of an unchanged listing: a cached body, and a 304 for a matching If-None-Match
+        etag = get(secure_client, first_page).headers["ETag"]
+        yield case("routes.api_products.first_page.cached", lambda: get(secure_client, first_page), number=200)
+        yield case("routes.api_products.first_page.not_modified", lambda: get(
+            secure_client, first_page, {"If-None-Match": etag}, 304), number=200)
+        user_id = max(size // 2, 1)
+        yield case("routes.api_users_search", lambda: get(
+            vulnerable_client, f"/api/users/search?condition=id%20%3D%20{user_id}"), number=50)
+        yield case("routes.health", lambda: get(secure_client, "/health"), number=200)
+    finally:
+        sql_utils.set_query_metrics(previous_metrics)
+
+
+SUITES = {
+    "sql": sql_suite,
+    "data": data_suite,
+    "projects": projects_suite,
+    "routes": routes_suite,
+}
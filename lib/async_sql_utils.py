@@ -0,0 +1,215 @@
+"""
+Asyncio counterparts of the sql_utils query functions
+"""
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Optional
+
+from . import sql_utils
+from .sql_utils import (
+    DEFAULT_BATCH_SIZE, QueryCache, QueryResult, abandon_inherited, connect_to_db, register_after_fork
+)
+
+# Queue item marking the end of a streamed result
+_DONE = object()
+
+
+class AsyncDatabase:
+    """
+    Run sql_utils queries for asyncio code on a bounded pool of threads
+
+    SQLite calls block, so they run on a ThreadPoolExecutor with max_workers
+    threads while the event loop keeps serving other requests. Every worker
+    thread lazily opens one connection and reuses it for all queries it runs,
+    so any number of concurrent tasks share at most max_workers connections;
+    tasks beyond that wait in the executor queue without blocking the loop.
+
+    Parameters:
+        db_path: Path to the SQLite database file
+        max_workers: Number of worker threads, and so of open connections
+        profile: TUNING_PROFILES entry applied to every connection
+        read_only: If True, open read-only connections
+        on_connect: Optional callback run on every new connection, e.g. QueryMetrics.instrument_connection
+    """
+
+    def __init__(self, db_path: str, max_workers: int = 4, profile: Optional[str] = "read_heavy",
+                 read_only: bool = False, on_connect: Optional[Callable[[sqlite3.Connection], None]] = None):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.profile = profile
+        self.read_only = read_only
+        self.on_connect = on_connect
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="sqlite-async")
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        register_after_fork(self)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get the calling worker thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Only this thread uses the connection; close() runs on another one
+            conn = connect_to_db(self.db_path, self.profile, self.read_only, check_same_thread=False)
+            if self.on_connect is not None:
+                self.on_connect(conn)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, func: Callable[..., Any], args: tuple) -> Any:
+        return func(self._connection(), *args)
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """
+        Run func(connection, *args) on a worker thread
+
+        Parameters:
+            func: Blocking callable taking a SQLite connection as its first argument
+            args: Further arguments for func
+
+        Returns:
+            The return value of func
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, func, args)
+
+    def close(self) -> None:
+        """Wait for running queries to finish and close all connections"""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+    def after_fork(self) -> None:
+        """Start the child process with its own worker threads and connections"""
+        abandon_inherited(self._connections)
+        self._connections = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="sqlite-async")
+
+
+async def execute_safe_query(db: AsyncDatabase, query: str, params: tuple, row_format: str = "dict",
+                             cache: Optional[QueryCache] = None) -> QueryResult:
+    """
+    Execute SQL query safely with parameterization without blocking the event loop
+
+    Parameters:
+        db: AsyncDatabase to run the query on
+        query: SQL query with placeholders (?)
+        params: Tuple of parameters to substitute in query
+        row_format: Row representation, one of ROW_FORMATS
+        cache: Optional QueryCache to serve repeated read queries from
+
+    Returns:
+        List of dictionaries representing rows (or the representation selected by row_format)
+    """
+    return await db.run(sql_utils.execute_safe_query, query, params, row_format, cache)
+
+
+async def search_records_safe(db: AsyncDatabase, table_name: str, search_term: str,
+                              row_format: str = "dict", use_fts: bool = True) -> QueryResult:
+    """Awaitable sql_utils.search_records_safe"""
+    return await db.run(sql_utils.search_records_safe, table_name, search_term, row_format, use_fts)
+
+
+async def direct_query_safe(db: AsyncDatabase, table_name: str, column_name: str, operator: str,
+                            value: Any, row_format: str = "dict",
+                            cache: Optional[QueryCache] = None) -> QueryResult:
+    """Awaitable sql_utils.direct_query_safe"""
+    return await db.run(sql_utils.direct_query_safe, table_name, column_name, operator, value,
+                        row_format, cache)
+
+
+async def iter_safe_query_batches(db: AsyncDatabase, query: str, params: tuple,
+                                  batch_size: int = DEFAULT_BATCH_SIZE, row_format: str = "dict",
+                                  prefetch: int = 2) -> AsyncIterator[QueryResult]:
+    """
+    Execute SQL query safely with parameterization and stream the results in batches
+
+    One worker thread reads the batches with fetchmany() and hands them to the
+    event loop through a queue holding at most prefetch batches, so a slow
+    consumer pauses the reader instead of buffering the whole result. The
+    worker thread (and its connection) stays busy until iteration ends; close
+    the generator (e.g. with contextlib.aclosing) when stopping early.
+
+    Parameters:
+        db: AsyncDatabase to run the query on
+        query: SQL query with placeholders (?)
+        params: Tuple of parameters to substitute in query
+        batch_size: Number of rows fetched from SQLite per batch
+        row_format: Row representation, one of ROW_FORMATS
+        prefetch: Maximum number of batches read ahead of the consumer
+
+    Returns:
+        Async generator of lists of dictionaries representing rows
+        (or the representation selected by row_format)
+    """
+    loop = asyncio.get_running_loop()
+    batches = asyncio.Queue(maxsize=max(prefetch, 1))
+    stop = threading.Event()
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(batches.put(item), loop).result()
+
+    def produce(conn):
+        outcome = _DONE
+        try:
+            for batch in sql_utils.iter_safe_query_batches(conn, query, params, batch_size, row_format):
+                if stop.is_set():
+                    return
+                put(batch)
+        except Exception as e:
+            outcome = e
+        if not stop.is_set():
+            put(outcome)
+
+    producer = asyncio.ensure_future(db.run(produce))
+    try:
+        while True:
+            item = await batches.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Unblock a producer waiting for room in the queue, then wait for it to let go of its connection
+        while not batches.empty():
+            batches.get_nowait()
+        await producer
+
+
+async def iter_safe_query(db: AsyncDatabase, query: str, params: tuple,
+                          batch_size: int = DEFAULT_BATCH_SIZE, row_format: str = "dict") -> AsyncIterator[Any]:
+    """
+    Execute SQL query safely with parameterization and stream the results row by row
+
+    Parameters:
+        db: AsyncDatabase to run the query on
+        query: SQL query with placeholders (?)
+        params: Tuple of parameters to substitute in query
+        batch_size: Number of rows fetched from SQLite at a time
+        row_format: Row representation, one of ROW_FORMATS except 'columnar'
+
+    Returns:
+        Async generator of dictionaries representing rows (or the representation selected by row_format)
+    """
+    if row_format == "columnar":
+        raise ValueError("Row format 'columnar' is only available for whole results or batches")
+    batches = iter_safe_query_batches(db, query, params, batch_size, row_format)
+    try:
+        async for batch in batches:
+            for row in batch:
+                yield row
+    finally:
+        await batches.aclose()
+
@@ -1,6 +1,14 @@
 """
 Data processing functions shared across projects.
 """
+import gc
+import os
+import random
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, reduce
+from itertools import chain, islice
 
 def filter_data(data, condition_func):
     """Filter a list based on a condition function"""
@@ -19,3 +27,414 @@ def group_by(items, key_func):
             result[key] = []
         result[key].append(item)
     return result
+
+class Pipeline:
+    """
+    Lazy, composable processing pipeline over any iterable
+
+    map() and filter() only record a stage and return a new pipeline. Iterating
+    runs all recorded stages on one item at a time in a single fused pass, so no
+    intermediate lists are built and memory is bounded by what the terminal
+    operation (collect, group, aggregate, ...) keeps.
+
+    Example:
+        Pipeline(users).map(clean_user).filter(is_adult).group(age_group)
+    """
+
+    def __init__(self, source, stages=()):
+        self._source = source
+        self._stages = tuple(stages)
+
+    def map(self, transform_func):
+        """Add a stage applying a function to every item"""
+        return Pipeline(self._source, self._stages + ((True, transform_func),))
+
+    def filter(self, condition_func):
+        """Add a stage keeping only items for which the condition is true"""
+        return Pipeline(self._source, self._stages + ((False, condition_func),))
+
+    def __iter__(self):
+        stages = self._stages
+        if not stages:
+            yield from self._source
+            return
+        for item in self._source:
+            for is_map, func in stages:
+                if is_map:
+                    item = func(item)
+                elif not func(item):
+                    break
+            else:
+                yield item
+
+    def chunks(self, size):
+        """Iterate over the results in lists of at most size items"""
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        return _chunked(self, size)
+
+    def collect(self):
+        """Run the pipeline and return the results as a list"""
+        return list(self)
+
+    def group(self, key_func):
+        """Run the pipeline and group the results by a key function"""
+        return group_by(self, key_func)
+
+    def aggregate(self, func, initial, key_func=None):
+        """
+        Run the pipeline and fold the results with func(accumulator, item)
+
+        Without key_func a single value is returned; with it, one accumulator is
+        kept per key and a dict of key -> value is returned. initial is shared
+        as the starting value of every key, so it should be immutable.
+        """
+        if key_func is None:
+            return reduce(func, self, initial)
+        result = {}
+        for item in self:
+            key = key_func(item)
+            result[key] = func(result.get(key, initial), item)
+        return result
+
+    def reduce_by_key(self, key_func, reducer):
+        """Run the pipeline and aggregate the results per key with streaming reducers"""
+        return reduce_by_key(self, key_func, reducer)
+
+def _chunked(items, size):
+    """Split an iterable into lists of at most size items"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _group_chunk(key_func, chunk):
+    """Worker: group the positions of one chunk's items, so only small ints are sent back"""
+    result = {}
+    for position, item in enumerate(chunk):
+        key = key_func(item)
+        if key not in result:
+            result[key] = []
+        result[key].append(position)
+    return result
+
+def _aggregate_chunk(key_func, func, initial, chunk):
+    """Worker: fold one chunk of items per key"""
+    return Pipeline(chunk).aggregate(func, initial, key_func)
+
+def _map_chunks(worker, chunks, workers):
+    """Run worker over chunks in a process pool, yielding (chunk, result) pairs in chunk order"""
+    # Freezing in the worker keeps its garbage collector from walking the heap it inherited on fork
+    with ProcessPoolExecutor(max_workers=workers, initializer=gc.freeze) as executor:
+        # Keep a bounded number of chunks in flight so the input is never fully materialized
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, executor.submit(worker, chunk)))
+            if len(pending) >= workers * 2:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+def _parallel_input(items, workers, min_parallel_size):
+    """Return (items, run_in_parallel), peeking at most min_parallel_size items to decide"""
+    iterator = iter(items)
+    head = list(islice(iterator, min_parallel_size))
+    parallel = workers > 1 and len(head) >= min_parallel_size
+    return chain(head, iterator), parallel
+
+def parallel_group_by(items, key_func, workers=None, chunk_size=50000, min_parallel_size=100000):
+    """
+    Group items by a key function across a pool of worker processes
+
+    The input is split into chunks of chunk_size items, each chunk is grouped in
+    a worker (which sends back item positions rather than the items) and the
+    partial groups are merged in chunk order, so the result is identical to
+    group_by(). Inputs smaller than min_parallel_size are grouped
+    serially, because starting processes would cost more than it saves.
+
+    key_func and the items must be picklable (e.g. key_func defined at module
+    level, not a lambda). Splitting only pays off when key_func is expensive
+    compared to pickling an item.
+    """
+    workers = workers or os.cpu_count() or 1
+    items, parallel = _parallel_input(items, workers, min_parallel_size)
+    if not parallel:
+        return group_by(items, key_func)
+
+    result = {}
+    worker = partial(_group_chunk, key_func)
+    for chunk, groups in _map_chunks(worker, _chunked(items, chunk_size), workers):
+        for key, positions in groups.items():
+            if key not in result:
+                result[key] = []
+            result[key].extend(map(chunk.__getitem__, positions))
+    return result
+
+def parallel_aggregate(items, key_func, func, initial, combine, workers=None, chunk_size=50000,
+                       min_parallel_size=100000):
+    """
+    Fold items per key with func(accumulator, item) across a pool of worker processes
+
+    Each worker folds its chunk like Pipeline.aggregate(func, initial, key_func)
+    and the per-chunk accumulators of a key are merged with combine(left, right)
+    in chunk order. Only the small per-key accumulators travel back from the
+    workers. Small inputs are folded serially; see parallel_group_by for the
+    picklability requirements.
+    """
+    workers = workers or os.cpu_count() or 1
+    items, parallel = _parallel_input(items, workers, min_parallel_size)
+    if not parallel:
+        return Pipeline(items).aggregate(func, initial, key_func)
+
+    result = {}
+    worker = partial(_aggregate_chunk, key_func, func, initial)
+    for _, accumulators in _map_chunks(worker, _chunked(items, chunk_size), workers):
+        for key, value in accumulators.items():
+            result[key] = combine(result[key], value) if key in result else value
+    return result
+
+class Reducer(ABC):
+    """
+    Streaming reducer for reduce_by_key
+
+    A reducer keeps a constant-size state per group instead of a list of its
+    items: initial() creates the state, update(state, item) folds one item in
+    and returns the new state, merge(left, right) combines the states of two
+    partitions and result(state) produces the final value. value_func picks the
+    value to reduce out of each item (the item itself by default).
+    """
+
+    def __init__(self, value_func=None):
+        self.value_func = value_func
+
+    def value(self, item):
+        """Get the value to reduce from an item"""
+        return item if self.value_func is None else self.value_func(item)
+
+    @abstractmethod
+    def initial(self):
+        """Create the state of an empty group"""
+
+    @abstractmethod
+    def update(self, state, item):
+        """Fold one item into a state and return the new state"""
+
+    @abstractmethod
+    def merge(self, left, right):
+        """Combine the states of the same group from two partitions"""
+
+    def result(self, state):
+        return state
+
+class Count(Reducer):
+    """Number of items in each group"""
+
+    def initial(self):
+        return 0
+
+    def update(self, state, item):
+        return state + 1
+
+    def merge(self, left, right):
+        return left + right
+
+class Sum(Reducer):
+    """Sum of the values in each group"""
+
+    def initial(self):
+        return 0
+
+    def update(self, state, item):
+        return state + self.value(item)
+
+    def merge(self, left, right):
+        return left + right
+
+class Mean(Reducer):
+    """Arithmetic mean of the values in each group (same as calculate_average of the values)"""
+
+    def initial(self):
+        return [0, 0]
+
+    def update(self, state, item):
+        state[0] += self.value(item)
+        state[1] += 1
+        return state
+
+    def merge(self, left, right):
+        return [left[0] + right[0], left[1] + right[1]]
+
+    def result(self, state):
+        return state[0] / state[1] if state[1] else 0
+
+class Min(Reducer):
+    """Smallest value in each group"""
+
+    def initial(self):
+        return None
+
+    def update(self, state, item):
+        value = self.value(item)
+        return value if state is None or value < state else state
+
+    def merge(self, left, right):
+        if left is None or (right is not None and right < left):
+            return right
+        return left
+
+class Max(Reducer):
+    """Largest value in each group"""
+
+    def initial(self):
+        return None
+
+    def update(self, state, item):
+        value = self.value(item)
+        return value if state is None or value > state else state
+
+    def merge(self, left, right):
+        if left is None or (right is not None and right > left):
+            return right
+        return left
+
+class Quantile(Reducer):
+    """
+    Approximate quantile(s) of the values in each group
+
+    Each group keeps a uniform reservoir sample of at most sample_size values,
+    so memory per group is constant; the quantiles are exact while a group has
+    no more than sample_size values. q may be a single fraction (0.5 for the
+    median) or a sequence of fractions, which returns a list.
+    """
+
+    def __init__(self, value_func=None, q=0.5, sample_size=1024, seed=0):
+        super().__init__(value_func)
+        fractions = q if isinstance(q, (list, tuple)) else [q]
+        if not all(0 <= fraction <= 1 for fraction in fractions):
+            raise ValueError("Quantiles must be between 0 and 1")
+        if sample_size < 1:
+            raise ValueError("sample_size must be at least 1")
+        self.q = q
+        self.sample_size = sample_size
+        self._random = random.Random(seed)
+
+    def initial(self):
+        # [number of values seen, reservoir sample]
+        return [0, []]
+
+    def update(self, state, item):
+        state[0] += 1
+        sample = state[1]
+        if len(sample) < self.sample_size:
+            sample.append(self.value(item))
+        else:
+            slot = self._random.randrange(state[0])
+            if slot < self.sample_size:
+                sample[slot] = self.value(item)
+        return state
+
+    def merge(self, left, right):
+        seen = left[0] + right[0]
+        if len(left[1]) + len(right[1]) <= self.sample_size:
+            return [seen, left[1] + right[1]]
+        # Draw from each side in proportion to how many values it has seen
+        from_left = min(len(left[1]), round(self.sample_size * left[0] / seen))
+        from_right = min(len(right[1]), self.sample_size - from_left)
+        sample = self._random.sample(left[1], from_left) + self._random.sample(right[1], from_right)
+        return [seen, sample]
+
+    def result(self, state):
+        sample = sorted(state[1])
+        if not sample:
+            return None
+
+        def interpolate(fraction):
+            position = fraction * (len(sample) - 1)
+            lower = int(position)
+            upper = min(lower + 1, len(sample) - 1)
+            return sample[lower] + (sample[upper] - sample[lower]) * (position - lower)
+
+        if isinstance(self.q, (list, tuple)):
+            return [interpolate(fraction) for fraction in self.q]
+        return interpolate(self.q)
+
+class _ReducerSet(Reducer):
+    """Several named reducers run side by side over the same groups"""
+
+    def __init__(self, reducers):
+        super().__init__()
+        self.reducers = dict(reducers)
+
+    def initial(self):
+        return [reducer.initial() for reducer in self.reducers.values()]
+
+    def update(self, state, item):
+        for index, reducer in enumerate(self.reducers.values()):
+            state[index] = reducer.update(state[index], item)
+        return state
+
+    def merge(self, left, right):
+        return [reducer.merge(l, r) for reducer, l, r in zip(self.reducers.values(), left, right)]
+
+    def result(self, state):
+        return {name: reducer.result(s) for (name, reducer), s in zip(self.reducers.items(), state)}
+
+def _as_reducer(reducer):
+    """Accept a Reducer or a dict of named reducers"""
+    return _ReducerSet(reducer) if isinstance(reducer, dict) else reducer
+
+def _reduce_states(items, key_func, reducer):
+    """Fold items into one reducer state per key"""
+    states = {}
+    initial = reducer.initial
+    update = reducer.update
+    for item in items:
+        key = key_func(item)
+        try:
+            state = states[key]
+        except KeyError:
+            state = initial()
+        states[key] = update(state, item)
+    return states
+
+def reduce_by_key(items, key_func, reducer):
+    """
+    Aggregate items per key without materializing the groups
+
+    Memory grows with the number of keys, not the number of items. reducer is a
+    Reducer (e.g. Count(), Mean(lambda p: p['price'])) giving {key: value}, or a
+    dict of named reducers giving {key: {name: value}}.
+    """
+    reducer = _as_reducer(reducer)
+    states = _reduce_states(items, key_func, reducer)
+    return {key: reducer.result(state) for key, state in states.items()}
+
+def _reduce_chunk(key_func, reducer, chunk):
+    """Worker: fold one chunk of items into reducer states per key"""
+    return _reduce_states(chunk, key_func, reducer)
+
+def parallel_reduce_by_key(items, key_func, reducer, workers=None, chunk_size=50000,
+                           min_parallel_size=100000):
+    """
+    reduce_by_key across a pool of worker processes
+
+    Per-chunk reducer states are combined with the reducer's merge(). See
+    parallel_group_by for the chunking, fallback and picklability rules; the
+    reducer's value functions must be picklable as well.
+    """
+    reducer = _as_reducer(reducer)
+    workers = workers or os.cpu_count() or 1
+    items, parallel = _parallel_input(items, workers, min_parallel_size)
+    if not parallel:
+        return reduce_by_key(items, key_func, reducer)
+
+    states = {}
+    worker = partial(_reduce_chunk, key_func, reducer)
+    for _, chunk_states in _map_chunks(worker, _chunked(items, chunk_size), workers):
+        for key, state in chunk_states.items():
+            states[key] = reducer.merge(states[key], state) if key in states else state
+    return {key: reducer.result(state) for key, state in states.items()}
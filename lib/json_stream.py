@@ -0,0 +1,224 @@
+"""
+Streaming JSON encoding of query results
+
+Rows are encoded batch by batch as they come off the cursor and sent as a
+chunked JSON document or as NDJSON (one object per line), so neither the
+result list nor the encoded body is ever held in memory as a whole.
+orjson is used when installed; otherwise the standard library encoder is
+used together with pre-encoded column-name fragments.
+"""
+import json
+import math
+from itertools import chain
+from json.encoder import encode_basestring
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+try:
+    import orjson
+except ImportError:  # optional fast encoder
+    orjson = None
+
+JSON_MIMETYPE = "application/json"
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# Response formats in order of preference; the first one wins for "Accept: */*"
+STREAM_MIMETYPES = (JSON_MIMETYPE, NDJSON_MIMETYPE)
+
+
+def _stdlib_dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _orjson_dumps(value: Any) -> bytes:
+    return orjson.dumps(value)
+
+
+# Encoder turning a JSON-serializable value into bytes; see set_json_encoder()
+dumps: Callable[[Any], bytes] = _orjson_dumps if orjson is not None else _stdlib_dumps
+
+
+def set_json_encoder(encoder: Optional[Callable[[Any], bytes]]) -> None:
+    """
+    Replace the encoder used by the streaming functions
+
+    Parameters:
+        encoder: Callable returning the compact JSON encoding of a value as bytes
+                 (e.g. orjson.dumps), or None for the default (orjson when installed)
+    """
+    global dumps
+    if encoder is None:
+        encoder = _orjson_dumps if orjson is not None else _stdlib_dumps
+    dumps = encoder
+
+
+def _encode_value(value: Any) -> str:
+    """Encode one SQLite value the way json.dumps would, without its per-call overhead"""
+    value_type = type(value)
+    if value_type is str:
+        return encode_basestring(value)
+    if value_type is int:
+        return int.__repr__(value)
+    if value_type is float and math.isfinite(value):
+        return float.__repr__(value)
+    return json.dumps(value, ensure_ascii=False)
+
+
+class RowEncoder:
+    """
+    Encodes tuple rows as JSON objects keyed by column name
+
+    With the default encoder, a batch of rows is turned into dictionaries and
+    encoded in a single call. A custom encoder set with set_json_encoder() is
+    called once per row. Without orjson, the column names are encoded once into
+    a row template and only the values are encoded per row.
+
+    Parameters:
+        columns: Column names, in the order of the values in each row
+    """
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = tuple(columns)
+        # '{"id":%s,"name":%s,...}' with every key already encoded
+        self._template = "{" + ",".join(encode_basestring(column) + ":%s" for column in self.columns) + "}"
+
+    def encode_objects(self, rows: Iterable[Sequence[Any]]) -> List[bytes]:
+        """Encode each row as one JSON object"""
+        columns = self.columns
+        if dumps is _orjson_dumps:
+            return [orjson.dumps(dict(zip(columns, row))) for row in rows]
+        if dumps is _stdlib_dumps:
+            template = self._template
+            return [(template % tuple(map(_encode_value, row))).encode() for row in rows]
+        return [dumps(dict(zip(columns, row))) for row in rows]
+
+    def encode_array_items(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        """Encode rows as comma-separated JSON objects (the inside of an array)"""
+        if dumps is _orjson_dumps:
+            columns = self.columns
+            return orjson.dumps([dict(zip(columns, row)) for row in rows])[1:-1]
+        return b",".join(self.encode_objects(rows))
+
+
+def iter_json_array(batches: Iterable[Sequence[Sequence[Any]]], columns: Sequence[str],
+                    key: Optional[str] = None,
+                    trailer: Optional[Callable[[], Optional[Dict[str, Any]]]] = None) -> Iterator[bytes]:
+    """
+    Encode batches of rows as one JSON document, one chunk per batch
+
+    Parameters:
+        batches: Iterable of lists of tuple rows (e.g. iter_safe_query_batches with row_format="tuple")
+        columns: Column names of the rows
+        key: If given, the rows go into an object under this key ({"key": [...]})
+             instead of being the whole document
+        trailer: Callable called after the last batch; the fields of the dictionary
+                 it returns are added to the object after the rows (requires key)
+
+    Returns:
+        Generator of encoded chunks
+    """
+    encoder = RowEncoder(columns)
+    head = b"[" if key is None else b"{" + dumps(key) + b":["
+    separator = b""
+    for batch in batches:
+        if not batch:
+            continue
+        yield head + separator + encoder.encode_array_items(batch)
+        head, separator = b"", b","
+    tail = b"]"
+    if key is not None:
+        for name, value in ((trailer() if trailer is not None else None) or {}).items():
+            tail += b"," + dumps(name) + b":" + dumps(value)
+        tail += b"}"
+    yield head + tail
+
+
+def iter_ndjson(batches: Iterable[Sequence[Sequence[Any]]], columns: Sequence[str],
+                trailer: Optional[Callable[[], Optional[Dict[str, Any]]]] = None) -> Iterator[bytes]:
+    """
+    Encode batches of rows as newline-delimited JSON, one chunk per batch
+
+    Parameters:
+        batches: Iterable of lists of tuple rows
+        columns: Column names of the rows
+        trailer: Callable called after the last batch; the dictionary it returns is
+                 written as one more line if any of its values is not None
+                 (e.g. a pagination cursor on all but the last page)
+
+    Returns:
+        Generator of encoded chunks
+    """
+    encoder = RowEncoder(columns)
+    for batch in batches:
+        if batch:
+            yield b"\n".join(encoder.encode_objects(batch)) + b"\n"
+    extra = trailer() if trailer is not None else None
+    if extra and any(value is not None for value in extra.values()):
+        yield dumps(extra) + b"\n"
+
+
+def negotiate_mimetype(accept_mimetypes) -> str:
+    """Pick JSON_MIMETYPE or NDJSON_MIMETYPE for a request's Accept header (werkzeug MIMEAccept)"""
+    return accept_mimetypes.best_match(STREAM_MIMETYPES, default=JSON_MIMETYPE)
+
+
+def stream_rows_response(batches: Iterable[Sequence[Sequence[Any]]], columns: Sequence[str],
+                         mimetype: str = JSON_MIMETYPE, key: Optional[str] = None,
+                         trailer: Optional[Callable[[], Optional[Dict[str, Any]]]] = None,
+                         status: int = 200):
+    """
+    Build a streamed Flask response for batches of rows
+
+    The first batch is fetched before the response is returned, so a query that
+    fails outright still raises in the view (and can become an error response);
+    an error after that can only cut the stream short. Each later batch is read
+    from the cursor only once the previous chunk has been handed to the server.
+
+    Parameters:
+        batches: Iterator of lists of tuple rows. It is closed together with the
+                 response, so a generator holding a pooled connection gives it back
+                 even if the client disconnects mid-stream
+        columns: Column names of the rows
+        mimetype: JSON_MIMETYPE for a JSON document, NDJSON_MIMETYPE for one row per line
+        key: Object key of the rows for JSON_MIMETYPE (see iter_json_array)
+        trailer: Callable returning fields sent after the rows (see iter_json_array/iter_ndjson)
+        status: HTTP status code
+
+    Returns:
+        Flask Response with a streamed body
+    """
+    from flask import Response
+
+    batches = iter(batches)
+    first = next(batches, None)
+    primed = chain([first] if first is not None else [], batches)
+    if mimetype == NDJSON_MIMETYPE:
+        body = iter_ndjson(primed, columns, trailer)
+    else:
+        body = iter_json_array(primed, columns, key, trailer)
+    response = Response(_StreamBody(body, batches), status=status, mimetype=mimetype)
+    response.headers["X-Accel-Buffering"] = "no"  # let reverse proxies pass chunks through
+    return response
+
+
+class _StreamBody:
+    """
+    Response body that closes the row source when the server closes the response
+
+    A generator that was never started ignores close(), so the row source (which
+    may hold a pooled connection since priming) is closed explicitly.
+    """
+
+    def __init__(self, chunks: Iterator[bytes], source: Iterator[Any]):
+        self._chunks = chunks
+        self._source = source
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self._chunks
+
+    def close(self) -> None:
+        try:
+            self._chunks.close()
+        finally:
+            close = getattr(self._source, "close", None)
+            if close is not None:
+                close()
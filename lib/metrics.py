@@ -0,0 +1,353 @@
+"""
+Metric primitives shared across projects.
+"""
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence
+
+# Upper bounds (in seconds) of the latency histogram buckets; a +Inf bucket is implied
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def format_labels(labels: Optional[Dict[str, str]]) -> str:
+    """Format a label set for the Prometheus text exposition format"""
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Histogram:
+    """
+    Thread-safe bucketed histogram with quantile estimates
+
+    Values are counted into fixed buckets, so memory is constant no matter how
+    many observations are recorded. Quantiles are estimated by linear
+    interpolation inside the bucket that contains them, the same way
+    Prometheus' histogram_quantile() does.
+
+    Parameters:
+        buckets: Sorted upper bounds of the buckets
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # the last slot is the +Inf bucket
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Record one value"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def quantile(self, q: float) -> float:
+        """Estimate the q-quantile (0 <= q <= 1) of the recorded values"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if total == 0:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    # Nothing is known above the last finite bound
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, object]:
+        """Get the count, sum, p50/p95/p99 estimates and cumulative bucket counts"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            value_sum = self._sum
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(list(self.buckets) + ["+Inf"], counts):
+            running += bucket_count
+            cumulative.append([bound, running])
+        return {
+            "count": total,
+            "sum": value_sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": cumulative,
+        }
+
+    def prometheus_lines(self, name: str, labels: Optional[Dict[str, str]] = None) -> List[str]:
+        """Render the histogram as Prometheus _bucket/_sum/_count sample lines"""
+        snapshot = self.snapshot()
+        labels = dict(labels or {})
+        lines = []
+        for bound, running in snapshot["buckets"]:
+            bucket_labels = dict(labels, le=bound if bound == "+Inf" else repr(float(bound)))
+            lines.append(f"{name}_bucket{format_labels(bucket_labels)} {running}")
+        lines.append(f"{name}_sum{format_labels(labels)} {snapshot['sum']}")
+        lines.append(f"{name}_count{format_labels(labels)} {snapshot['count']}")
+        return lines
+
+
+# Upper bounds (in bytes) of the response size histogram buckets
+DEFAULT_SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+# WSGI environ key the Flask hook stores the matched route rule under
+ROUTE_ENVIRON_KEY = "metrics.route"
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _RouteStats:
+    """Counters for one (route, method) pair"""
+
+    def __init__(self):
+        self.statuses = {}
+        self.latency = Histogram()
+        self.response_size = Histogram(DEFAULT_SIZE_BUCKETS)
+
+
+class RequestMetrics:
+    """
+    Per-endpoint HTTP request metrics
+
+    Tracks request counts by status, latency and response size histograms per
+    route and method, and the number of requests currently in flight.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def request_started(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def request_finished(self, route: str, method: str, status: str, seconds: float, size: int) -> None:
+        """Record a finished request and leave the in-flight count"""
+        with self._lock:
+            self.in_flight -= 1
+            stats = self._routes.get((route, method))
+            if stats is None:
+                stats = self._routes[(route, method)] = _RouteStats()
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        stats.latency.observe(seconds)
+        stats.response_size.observe(size)
+
+    def snapshot(self) -> Dict[str, object]:
+        """Get all recorded metrics as a JSON-serializable dictionary"""
+        with self._lock:
+            routes = list(self._routes.items())
+            result = {"in_flight": self.in_flight, "max_in_flight": self.max_in_flight}
+        result["routes"] = [
+            {
+                "route": route,
+                "method": method,
+                "statuses": dict(stats.statuses),
+                "latency": stats.latency.snapshot(),
+                "response_size": stats.response_size.snapshot(),
+            }
+            for (route, method), stats in routes
+        ]
+        return result
+
+    def to_prometheus(self) -> str:
+        """Render all recorded metrics in the Prometheus text exposition format"""
+        with self._lock:
+            routes = [(key, stats, dict(stats.statuses)) for key, stats in self._routes.items()]
+            in_flight = self.in_flight
+        lines = [
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {in_flight}",
+            "# TYPE http_requests_total counter",
+        ]
+        for (route, method), _, statuses in routes:
+            for status, count in sorted(statuses.items()):
+                labels = {"route": route, "method": method, "status": status}
+                lines.append(f"http_requests_total{format_labels(labels)} {count}")
+        lines.append("# TYPE http_request_duration_quantile_seconds gauge")
+        for (route, method), stats, _ in routes:
+            for q in (0.5, 0.95, 0.99):
+                labels = {"route": route, "method": method, "quantile": q}
+                lines.append(f"http_request_duration_quantile_seconds{format_labels(labels)} "
+                             f"{stats.latency.quantile(q)}")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for (route, method), stats, _ in routes:
+            lines.extend(stats.latency.prometheus_lines("http_request_duration_seconds",
+                                                        {"route": route, "method": method}))
+        lines.append("# TYPE http_response_size_bytes histogram")
+        for (route, method), stats, _ in routes:
+            lines.extend(stats.response_size.prometheus_lines("http_response_size_bytes",
+                                                              {"route": route, "method": method}))
+        return "\n".join(lines) + "\n"
+
+
+class _MeteredBody:
+    """WSGI response body wrapper that counts bytes and reports once the body is sent or closed"""
+
+    def __init__(self, body, on_finish):
+        self._body = body
+        self._on_finish = on_finish
+        self.size = 0
+
+    def _finish(self):
+        if self._on_finish is not None:
+            on_finish, self._on_finish = self._on_finish, None
+            on_finish(self.size)
+
+    def __iter__(self):
+        for chunk in self._body:
+            self.size += len(chunk)
+            yield chunk
+        self._finish()
+
+    def close(self):
+        try:
+            if hasattr(self._body, "close"):
+                self._body.close()
+        finally:
+            self._finish()
+
+
+class RequestMetricsMiddleware:
+    """
+    WSGI middleware recording RequestMetrics for every request
+
+    Latency is measured until the server has sent the last byte of the body,
+    so streamed responses are timed in full.
+
+    Optionally profiles a sample of requests with cProfile and keeps the
+    profile of each sampled request slower than profile_threshold as a .prof
+    file in profile_dir (inspect with python -m pstats). Only one request is
+    profiled at a time.
+
+    Parameters:
+        wsgi_app: WSGI application to wrap
+        metrics: RequestMetrics to record into
+        profile_dir: Directory for captured profiles; None disables profiling
+        profile_sample_rate: Fraction of requests to profile (0 to 1)
+        profile_threshold: Minimum request duration in seconds for a profile to be kept
+    """
+
+    def __init__(self, wsgi_app, metrics: RequestMetrics, profile_dir: Optional[str] = None,
+                 profile_sample_rate: float = 0.0, profile_threshold: float = 0.5):
+        self.wsgi_app = wsgi_app
+        self.metrics = metrics
+        self.profile_dir = profile_dir
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_threshold = profile_threshold
+        self._profiling = threading.Lock()
+
+    def _start_profile(self):
+        if not self.profile_dir or random.random() >= self.profile_sample_rate:
+            return None
+        if not self._profiling.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this interpreter
+            self._profiling.release()
+            return None
+        return profiler
+
+    def _finish_profile(self, profiler, route: str, seconds: float) -> None:
+        try:
+            profiler.disable()
+            if seconds >= self.profile_threshold:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                name = re.sub(r"[^A-Za-z0-9_.-]+", "_", route).strip("_") or "root"
+                filename = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{int(seconds * 1000)}ms.prof"
+                profiler.dump_stats(os.path.join(self.profile_dir, filename))
+        finally:
+            self._profiling.release()
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        self.metrics.request_started()
+        profiler = self._start_profile()
+        status = ["500"]
+
+        def metered_start_response(status_line, headers, exc_info=None):
+            status[0] = status_line.split(" ", 1)[0]
+            return start_response(status_line, headers, exc_info)
+
+        def finish(size):
+            seconds = time.perf_counter() - started
+            route = environ.get(ROUTE_ENVIRON_KEY, "<unmatched>")
+            if profiler is not None:
+                self._finish_profile(profiler, route, seconds)
+            self.metrics.request_finished(route, environ.get("REQUEST_METHOD", ""), status[0], seconds, size)
+
+        try:
+            body = self.wsgi_app(environ, metered_start_response)
+        except Exception:
+            finish(0)
+            raise
+        return _MeteredBody(body, finish)
+
+
+def install_request_metrics(app, exporters: Sequence = (), path: str = "/metrics",
+                            **profile_options) -> RequestMetrics:
+    """
+    Record request metrics for a Flask app and serve them on a Prometheus endpoint
+
+    Parameters:
+        app: Flask application
+        exporters: Extra callables returning Prometheus text to append to the endpoint
+                   (e.g. QueryMetrics.to_prometheus)
+        path: URL path of the metrics endpoint
+        profile_options: profile_dir, profile_sample_rate and profile_threshold,
+                         see RequestMetricsMiddleware
+
+    Returns:
+        The RequestMetrics the app records into
+    """
+    from flask import request
+
+    metrics = RequestMetrics()
+
+    @app.before_request
+    def _remember_route():
+        # Label by route rule rather than raw path to keep the number of series bounded
+        request.environ[ROUTE_ENVIRON_KEY] = request.url_rule.rule if request.url_rule else "<unmatched>"
+
+    def prometheus_metrics():
+        """Request metrics (and any extra exporters) in Prometheus text format"""
+        body = metrics.to_prometheus() + "".join(exporter() for exporter in exporters)
+        return body, 200, {"Content-Type": PROMETHEUS_CONTENT_TYPE}
+
+    app.add_url_rule(path, "prometheus_metrics", prometheus_metrics)
+    app.wsgi_app = RequestMetricsMiddleware(app.wsgi_app, metrics, **profile_options)
+    return metrics
@@ -0,0 +1,234 @@
+"""
+HTTP response caching with ETags derived from the database version
+"""
+import functools
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .sql_utils import abandon_inherited, register_after_fork
+
+
+class ResponseCache:
+    """
+    Conditional GET and an LRU of encoded response bodies for read-only Flask views
+
+    The ETag of a response is a hash of the database version and the normalized
+    request (path, negotiated format and sorted query arguments), so it is known
+    before the view runs: a request whose If-None-Match matches gets
+    304 Not Modified without running the view, and a cached body is served
+    as is. Any commit to the database changes the version and with it every ETag.
+
+    The version is PRAGMA data_version on a private watcher connection, read at
+    most every version_ttl seconds so that revalidations within that window do
+    not touch SQLite at all. A commit from another connection can therefore go
+    unnoticed for up to version_ttl seconds; writes made by this process should
+    call invalidate() to be visible at once. data_version values are only
+    comparable on one connection, so ETags are specific to the process (and to
+    the lifetime of the cache): behind a prefork server, revalidating against
+    another worker yields a full response with that worker's ETag.
+
+    Parameters:
+        db_path: Path to the SQLite database file the cached views read
+        max_bytes: Maximum total size of the cached bodies
+        max_entry_bytes: Largest body that is cached (default: max_bytes // 8)
+        ttl: Seconds a cached body is kept even if the database does not change
+        version_ttl: Seconds the database version is trusted before it is read again
+    """
+
+    def __init__(self, db_path: str, max_bytes: int = 16 * 1024 * 1024, max_entry_bytes: Optional[int] = None,
+                 ttl: float = 60.0, version_ttl: float = 0.1):
+        if max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1")
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 8
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # etag -> (expires_at, body, mimetype), least recently used first
+        self._bytes = 0
+        self._watcher = None
+        self._instance = os.urandom(4).hex()
+        self._data_version = None
+        self._generation = 0
+        self._version_checked_at = float("-inf")
+        self._lock = threading.Lock()
+        register_after_fork(self)
+
+    def _clear(self) -> None:
+        """Drop every cached body (caller holds the lock)"""
+        if self._entries:
+            self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def version(self) -> str:
+        """Get the current database version token, reading data_version at most every version_ttl seconds"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._version_checked_at >= self.version_ttl:
+                if self._watcher is None:
+                    self._watcher = sqlite3.connect(self.db_path, check_same_thread=False)
+                data_version = self._watcher.execute("PRAGMA data_version").fetchone()[0]
+                if data_version != self._data_version:
+                    self._data_version = data_version
+                    self._clear()
+                self._version_checked_at = now
+            return f"{self._instance}.{self._data_version}.{self._generation}"
+
+    def invalidate(self) -> None:
+        """Change every ETag and drop every cached body, e.g. right after a write by this process"""
+        with self._lock:
+            self._generation += 1
+            self._clear()
+
+    @staticmethod
+    def request_key(request, variant: str = "") -> str:
+        """
+        Normalize a request into a cache key
+
+        Query arguments are sorted by name and value, so reordering them (or the
+        values of a repeated argument) maps to the same key.
+        """
+        args = sorted((name, value) for name, values in request.args.lists() for value in values)
+        return f"{request.path}\0{variant}\0{args!r}"
+
+    def etag(self, key: str, version: Optional[str] = None) -> str:
+        """Compute the ETag of a request key at a database version (default: the current one)"""
+        if version is None:
+            version = self.version()
+        return hashlib.blake2b(f"{version}\0{key}".encode(), digest_size=16).hexdigest()
+
+    def get(self, etag: str) -> Optional[Tuple[bytes, str]]:
+        """Get the cached (body, mimetype) for an ETag, or None"""
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(etag)
+                    self.hits += 1
+                    return entry[1], entry[2]
+                del self._entries[etag]
+                self._bytes -= len(entry[1])
+            self.misses += 1
+            return None
+
+    def put(self, etag: str, body: bytes, mimetype: str, version: str) -> bool:
+        """
+        Cache an encoded body under its ETag
+
+        Parameters:
+            etag: ETag the body was produced for
+            body: Encoded response body
+            mimetype: Mimetype of the body
+            version: Version token the ETag was computed at
+
+        Returns:
+            True if the body was cached; bodies over max_entry_bytes, or produced
+            while the database changed, are not
+        """
+        if len(body) > self.max_entry_bytes:
+            return False
+        if self.version() != version:
+            return False
+        with self._lock:
+            previous = self._entries.pop(etag, None)
+            if previous is not None:
+                self._bytes -= len(previous[1])
+            self._entries[etag] = (time.monotonic() + self.ttl, body, mimetype)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+        return True
+
+    def cached(self, variant: Optional[Callable[[], str]] = None) -> Callable:
+        """
+        Decorator adding conditional GET and body caching to a read-only Flask view
+
+        Successful responses get the ETag and "Cache-Control: no-cache" (clients
+        revalidate on every use). Buffered 200 responses are cached; streamed ones
+        only get the ETag.
+
+        Parameters:
+            variant: Callable returning the part of the request, besides path and query
+                     arguments, that selects the representation (e.g. the negotiated
+                     mimetype); it is also announced with "Vary: Accept"
+        """
+        from flask import make_response, request
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                version = self.version()
+                etag = self.etag(self.request_key(request, variant() if variant else ""), version)
+                if request.if_none_match.contains_weak(etag):
+                    with self._lock:
+                        self.not_modified += 1
+                    return self._finish(make_response("", 304), etag, variant)
+                entry = self.get(etag)
+                if entry is not None:
+                    body, mimetype = entry
+                    return self._finish(make_response(body, 200, {"Content-Type": mimetype}), etag, variant)
+
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if not response.is_streamed:
+                    self.put(etag, response.get_data(), response.content_type, version)
+                return self._finish(response, etag, variant)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _finish(response, etag: str, variant: Optional[Callable[[], str]]):
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        if variant is not None:
+            response.vary.add("Accept")
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit/miss/304 counters, the number of cached bodies and their total size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def close(self) -> None:
+        """Drop every cached body and close the watcher connection"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._data_version = None
+            self._version_checked_at = float("-inf")
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+
+    def after_fork(self) -> None:
+        """Start over in a forked worker with its own watcher connection and ETags"""
+        abandon_inherited([self._watcher])
+        self._watcher = None
+        self._instance = os.urandom(4).hex()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._data_version = None
+        self._version_checked_at = float("-inf")
+        self._lock = threading.Lock()
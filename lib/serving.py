@@ -0,0 +1,113 @@
+"""
+Prefork serving for the Flask apps
+"""
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# A worker exiting sooner than this after its start counts as a crash; respawns are delayed
+MIN_WORKER_LIFETIME = 1.0
+
+
+def _run_worker(app_factory: Callable, listener: socket.socket) -> None:
+    """Body of a worker process: build the app and serve the shared socket with threads"""
+    from werkzeug.serving import make_server
+
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, app_factory(), threaded=True, fd=listener.fileno())
+
+    # The parent handles Ctrl+C for the whole group and stops workers with SIGTERM.
+    # shutdown() waits for serve_forever() to return, so it cannot run in the handler itself.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    server.serve_forever()
+
+
+def serve_prefork(app_factory: Callable, host: str = "127.0.0.1", port: int = 8000,
+                  workers: Optional[int] = None, before_fork: Optional[Callable[[], None]] = None,
+                  backlog: int = 1024) -> None:
+    """
+    Serve a WSGI app from several forked worker processes sharing one socket
+
+    The parent binds the listening socket and runs before_fork (e.g. database
+    initialization) exactly once, then forks the workers. Every worker calls
+    app_factory to build its own app and serves the inherited socket with a
+    thread per connection, so requests are spread over all cores by the kernel.
+    SQLite handles opened in the parent are never used in a worker: the pools
+    and caches in lib.sql_utils start over after a fork (see register_after_fork).
+
+    Workers that die are replaced. SIGINT or SIGTERM to the parent stops all
+    workers and returns once they have exited. POSIX only.
+
+    Parameters:
+        app_factory: Callable returning the WSGI application, called in each worker
+        host: Interface to listen on
+        port: TCP port to listen on
+        workers: Number of worker processes (default: number of CPUs)
+        before_fork: Optional callable run once in the parent before any worker starts
+        backlog: Listen backlog of the shared socket
+    """
+    if not hasattr(os, "fork"):
+        raise RuntimeError("Prefork serving needs os.fork(); use a single-process server on this platform")
+    workers = workers or os.cpu_count() or 1
+    if before_fork is not None:
+        before_fork()
+
+    listener = socket.create_server((host, port), backlog=backlog)
+    listener.set_inheritable(True)
+    children = {}  # pid -> start time
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                _run_worker(app_factory, listener)
+            except BaseException:
+                logger.exception("Worker %d failed", os.getpid())
+                status = 1
+            finally:
+                # Never return into the parent's code in the child
+                os._exit(status)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    previous_handlers = {signum: signal.signal(signum, stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        for _ in range(workers):
+            spawn()
+        logger.info("Serving on http://%s:%d with %d worker processes", host, listener.getsockname()[1], workers)
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            started = children.pop(pid, None)
+            if stopping or started is None:
+                continue
+            logger.warning("Worker %d exited with status %d, starting a new one", pid,
+                           os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            spawn()
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        listener.close()
@@ -1,16 +1,709 @@
 """
 SQL Utilities for database operations
 """
+import csv
+import json
+import logging
+import os
+import queue
+import re
 import sqlite3
-from typing import List, Dict, Any, Optional
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain, islice
+from typing import List, Dict, Any, Optional, Iterator, Iterable, Sequence, Union, Callable
+from urllib.parse import quote
 
+from .metrics import Histogram, format_labels
 
-def connect_to_db(db_path: str) -> sqlite3.Connection:
-    """Create a connection to the SQLite database"""
-    return sqlite3.connect(db_path)
+logger = logging.getLogger(__name__)
 
+# Result of a query: a list of rows, or a dict of column lists for the 'columnar' format
+QueryResult = Union[List[Any], Dict[str, List[Any]]]
 
-def execute_safe_query(db_conn: sqlite3.Connection, query: str, params: tuple) -> List[Dict[str, Any]]:
+# Objects whose after_fork() runs in the child process after every os.fork()
+_fork_aware = weakref.WeakSet()
+
+# SQLite handles opened before a fork. The child must never use them, and must not
+# close them either (closing the last connection can checkpoint and delete the
+# parent's WAL file), so they stay referenced here for the life of the process.
+_inherited_handles = []
+
+
+def register_after_fork(obj: Any) -> None:
+    """
+    Have obj.after_fork() called in the child process after every os.fork()
+    
+    Objects that own SQLite connections or threads use this to start over with
+    fresh state in forked worker processes instead of sharing the parent's handles.
+    """
+    _fork_aware.add(obj)
+
+
+def abandon_inherited(handles: Iterable[Any]) -> None:
+    """Keep handles inherited from the parent process referenced without ever using or closing them"""
+    _inherited_handles.extend(handle for handle in handles if handle is not None)
+
+
+def _after_fork_in_child() -> None:
+    for obj in list(_fork_aware):
+        obj.after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+# Pragmas applied for the duration of a bulk load: no fsync per chunk, a large
+# page cache and in-memory temp b-trees for index rebuilds
+BULK_LOAD_PRAGMAS = {
+    "synchronous": "OFF",
+    "cache_size": -262144,  # negative values are KiB, i.e. 256 MiB
+    "temp_store": "MEMORY",
+}
+
+
+def _apply_pragmas(db_conn: sqlite3.Connection, pragmas: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply pragmas to a connection and return their previous values"""
+    previous = {}
+    for name, value in pragmas.items():
+        _validate_identifier(name)
+        previous[name] = db_conn.execute(f"PRAGMA {name}").fetchone()[0]
+        db_conn.execute(f"PRAGMA {name} = {value}")
+    return previous
+
+
+# Named pragma sets for connect_to_db(), applied in order on every new connection
+TUNING_PROFILES = {
+    # WAL lets readers run alongside a writer, and a large page cache plus
+    # memory-mapped I/O keep the working set out of read() system calls
+    "read_heavy": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,  # 64 MiB
+        "mmap_size": 268435456,  # 256 MiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    # WAL with fsync only at checkpoints, fewer and larger checkpoints, and a
+    # long busy timeout so writers queue up instead of failing with "database is locked"
+    "write_heavy": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -32768,  # 32 MiB
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 10000,
+        "busy_timeout": 30000,
+    },
+    # Dedicated ingestion connections, see bulk_load()
+    "bulk_load": dict(BULK_LOAD_PRAGMAS, journal_mode="WAL", busy_timeout=60000),
+}
+
+# Pragmas that need write access to the database file
+_WRITE_PRAGMAS = ("journal_mode", "wal_autocheckpoint")
+
+
+def connect_to_db(db_path: str, profile: Optional[str] = None, read_only: bool = False,
+                  check_same_thread: bool = True) -> sqlite3.Connection:
+    """
+    Create a connection to the SQLite database
+    
+    Parameters:
+        db_path: Path to the SQLite database file
+        profile: Optional name of a TUNING_PROFILES entry to apply to the connection
+        read_only: If True, open the file through a read-only URI; writes fail with OperationalError
+        check_same_thread: If False, allow the connection to be used from other threads
+                           (the caller must serialize access, as ConnectionPool does)
+        
+    Returns:
+        SQLite database connection
+    """
+    if profile is not None and profile not in TUNING_PROFILES:
+        raise ValueError(f"Unknown tuning profile '{profile}'. Use one of: {', '.join(TUNING_PROFILES)}")
+    if read_only:
+        conn = sqlite3.connect(f"file:{quote(db_path)}?mode=ro", uri=True,
+                               check_same_thread=check_same_thread)
+    else:
+        conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+    if profile is not None:
+        for name, value in TUNING_PROFILES[profile].items():
+            if read_only and name in _WRITE_PRAGMAS:
+                continue
+            conn.execute(f"PRAGMA {name} = {value}").fetchall()
+    return conn
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of SQLite connections
+    
+    Connections are opened lazily, handed out through the connection()
+    context manager and returned to the pool afterwards instead of being
+    closed, so callers stop paying for opening the file and parsing the
+    schema on every request.
+    
+    Parameters:
+        db_path: Path to the SQLite database file
+        max_size: Maximum number of open connections (idle + checked out)
+        idle_timeout: Seconds an idle connection may sit in the pool before it is closed
+        checkout_timeout: Seconds to wait for a free connection before raising TimeoutError
+        health_check: If True, run a trivial query on checkout and replace broken connections
+        on_connect: Optional callback run on every new connection, e.g. QueryMetrics.instrument_connection
+        profile: Optional TUNING_PROFILES entry applied to every connection (see connect_to_db)
+        read_only: If True, open read-only connections
+    """
+
+    def __init__(self, db_path: str, max_size: int = 5, idle_timeout: float = 300.0,
+                 checkout_timeout: float = 30.0, health_check: bool = True,
+                 on_connect: Optional[Callable[[sqlite3.Connection], None]] = None,
+                 profile: Optional[str] = None, read_only: bool = False):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.db_path = db_path
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check = health_check
+        self.on_connect = on_connect
+        self.profile = profile
+        self.read_only = read_only
+        self._idle = deque()  # (connection, returned_at) pairs, most recently used on the right
+        self._size = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        register_after_fork(self)
+
+    def _open(self) -> sqlite3.Connection:
+        # Pooled connections move between threads, so the same-thread check is disabled;
+        # the pool guarantees a connection is only used by one thread at a time.
+        conn = connect_to_db(self.db_path, self.profile, self.read_only, check_same_thread=False)
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _evict_idle(self) -> List[sqlite3.Connection]:
+        """Pop connections idle longer than idle_timeout (caller holds the lock)"""
+        expired = []
+        cutoff = time.monotonic() - self.idle_timeout
+        # Oldest connections sit on the left
+        while self._idle and self._idle[0][1] < cutoff:
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+        return expired
+
+    def _acquire(self) -> sqlite3.Connection:
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._available:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Cannot use a closed connection pool")
+                expired = self._evict_idle()
+                if self._idle:
+                    conn = self._idle.pop()[0]
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"No connection available from pool for {self.db_path} "
+                        f"after {self.checkout_timeout} seconds"
+                    )
+                self._available.wait(remaining)
+
+        for stale in expired:
+            stale.close()
+
+        try:
+            if conn is None:
+                conn = self._open()
+            elif self.health_check and not self._is_healthy(conn):
+                conn.close()
+                conn = self._open()
+        except Exception:
+            self._discard()
+            raise
+        return conn
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        # Never hand out a connection with a half-finished transaction
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            self._discard()
+            return
+
+        with self._available:
+            if self._closed:
+                self._size -= 1
+                conn.close()
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    def _discard(self) -> None:
+        with self._available:
+            self._size -= 1
+            self._available.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Check a connection out of the pool for the duration of a with block
+        
+        Returns:
+            Context manager yielding a SQLite database connection
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def close(self) -> None:
+        """Close all idle connections; checked out connections are closed when returned"""
+        with self._available:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._available.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def after_fork(self) -> None:
+        """Forget the connections opened by the parent process; new ones are opened on demand"""
+        abandon_inherited(conn for conn, _ in self._idle)
+        self._idle = deque()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+
+# Outcome of a single write statement run by WriteQueue
+WriteResult = namedtuple("WriteResult", ["rowcount", "lastrowid"])
+
+# Queue item telling the writer thread to stop
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    Serialize all writes to a SQLite database through one writer thread
+
+    SQLite allows a single writer at a time, so instead of every request
+    thread opening its own write transaction (and waiting on the lock), write
+    operations are queued and run by a dedicated thread. The thread drains up
+    to max_batch_size queued operations into one BEGIN IMMEDIATE transaction
+    and commits them together, so a burst of writes costs one commit (and
+    fsync) instead of one per operation. Each operation runs inside its own
+    SAVEPOINT: a failing operation is rolled back on its own and only its
+    future receives the exception. Operations may not commit or roll back: such
+    statements (conn.commit(), conn.rollback(), executescript() included) are
+    denied and fail only that operation. If a trigger ends the whole transaction
+    with RAISE(ROLLBACK), nothing of its batch is committed, every operation of
+    the batch fails and the writer carries on with the next batch.
+
+    Futures are resolved after the commit, so a caller that waits on its
+    future can immediately read its own write from any connection.
+
+    Parameters:
+        db_path: Path to the SQLite database file
+        profile: TUNING_PROFILES entry for the writer connection
+        max_batch_size: Maximum number of operations committed together
+        max_batch_delay: Seconds to wait for more operations to join a batch once one arrives
+                         (0 commits whatever is queued right away)
+        on_connect: Optional callback run on the writer connection after it is opened
+    """
+
+    def __init__(self, db_path: str, profile: Optional[str] = "write_heavy", max_batch_size: int = 256,
+                 max_batch_delay: float = 0.0,
+                 on_connect: Optional[Callable[[sqlite3.Connection], None]] = None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.db_path = db_path
+        self.profile = profile
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.on_connect = on_connect
+        self.operations = 0
+        self.batches = 0
+        self.failed_operations = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._conn = None
+        self._transaction_denied = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._start_writer()
+        register_after_fork(self)
+
+    def _start_writer(self) -> None:
+        self._thread = threading.Thread(target=self._run, name=f"sqlite-writer:{self.db_path}", daemon=True)
+        self._thread.start()
+
+    def submit(self, operation: Callable[[sqlite3.Connection], Any]) -> Future:
+        """
+        Queue an operation to run on the writer connection
+
+        Parameters:
+            operation: Callable receiving the writer connection; it must not commit or roll back
+                       (such statements are denied and fail the operation)
+
+        Returns:
+            Future resolved with the operation's return value once its batch has committed
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Cannot write through a closed write queue")
+            self._queue.put((future, operation))
+        return future
+
+    def execute(self, query: str, params: tuple = ()) -> Future:
+        """Queue one parameterized write statement; the future resolves to a WriteResult"""
+        def operation(conn):
+            cursor = conn.execute(query, params)
+            return WriteResult(cursor.rowcount, cursor.lastrowid)
+        return self.submit(operation)
+
+    def executemany(self, query: str, seq_of_params: Iterable[tuple]) -> Future:
+        """Queue a statement run once per parameter tuple; the future resolves to a WriteResult"""
+        seq_of_params = list(seq_of_params)
+
+        def operation(conn):
+            cursor = conn.executemany(query, seq_of_params)
+            return WriteResult(cursor.rowcount, cursor.lastrowid)
+        return self.submit(operation)
+
+    def _next_batch(self) -> List[Any]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_batch_delay
+        while len(batch) < self.max_batch_size and batch[-1] is not _STOP:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_batch(self, conn: sqlite3.Connection, batch: List[Any]) -> None:
+        # Drop operations whose caller cancelled them while they were queued
+        batch = [(future, operation) for future, operation in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            for future, _ in batch:
+                future.set_exception(e)
+            return
+        aborted = None
+        # Operations run inside the batch transaction and must not end it; the authorizer
+        # rejects BEGIN/COMMIT/ROLLBACK (including conn.commit() and executescript()) until
+        # it is removed again, which also expires any already prepared COMMIT
+        conn.set_authorizer(self._authorize)
+        try:
+            for index, (future, operation) in enumerate(batch):
+                self._transaction_denied = False
+                try:
+                    conn.execute("SAVEPOINT write_op")
+                    result = operation(conn)
+                    if not conn.in_transaction:
+                        raise sqlite3.ProgrammingError("Write operations must not commit or roll back the transaction")
+                    conn.execute("RELEASE write_op")
+                    outcomes.append((future, result, None))
+                    continue
+                except Exception as e:
+                    error = e
+                    if self._transaction_denied:
+                        error = sqlite3.ProgrammingError(
+                            "Write operations must not commit or roll back; the write queue commits the batch")
+                        error.__cause__ = e
+                if conn.in_transaction:
+                    try:
+                        conn.execute("ROLLBACK TO write_op")
+                        conn.execute("RELEASE write_op")
+                        outcomes.append((future, None, error))
+                        continue
+                    except sqlite3.Error as rollback_error:
+                        error = rollback_error
+                # The transaction was rolled back (e.g. a trigger ran RAISE(ROLLBACK)) or
+                # cannot be recovered: nothing in this batch is committed
+                aborted = (index, error)
+                break
+        finally:
+            conn.set_authorizer(None)
+
+        if aborted is not None:
+            outcomes = self._abort_batch(conn, batch, outcomes, *aborted)
+        else:
+            try:
+                conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._rollback(conn)
+                outcomes = [(future, None, error or e) for future, _, error in outcomes]
+
+        failed = sum(1 for _, _, error in outcomes if error is not None)
+        with self._lock:
+            self.batches += 1
+            self.operations += len(outcomes)
+            self.failed_operations += failed
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _authorize(self, action: int, *args: Any) -> int:
+        """Authorizer of the writer connection while operations run: deny transaction control"""
+        if action == sqlite3.SQLITE_TRANSACTION:
+            self._transaction_denied = True
+            return sqlite3.SQLITE_DENY
+        return sqlite3.SQLITE_OK
+
+    @staticmethod
+    def _rollback(conn: sqlite3.Connection) -> None:
+        """Roll back whatever transaction is still open on the writer connection"""
+        try:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            logger.exception("Could not roll back write transaction")
+
+    def _abort_batch(self, conn: sqlite3.Connection, batch: List[Any], outcomes: List[Any], index: int,
+                     error: Exception) -> List[Any]:
+        """Fail every operation of a batch whose transaction ended early; batch[index] caused it"""
+        self._rollback(conn)
+        aborted = sqlite3.OperationalError(f"Write batch aborted: {error}")
+        aborted.__cause__ = error
+        return ([(future, None, aborted) for future, _, _ in outcomes]
+                + [(batch[index][0], None, error)]
+                + [(future, None, aborted) for future, _ in batch[index + 1:]])
+
+    def _run(self) -> None:
+        conn = None
+        try:
+            conn = self._conn = connect_to_db(self.db_path, self.profile)
+            # Transactions are managed explicitly with BEGIN IMMEDIATE / COMMIT
+            conn.isolation_level = None
+            if self.on_connect is not None:
+                self.on_connect(conn)
+        except Exception as e:
+            logger.exception("Could not open writer connection to %s", self.db_path)
+            self._fail_pending(e)
+            return
+        try:
+            while True:
+                batch = self._next_batch()
+                stop = batch[-1] is _STOP
+                if stop:
+                    batch.pop()
+                try:
+                    self._run_batch(conn, batch)
+                except Exception as e:
+                    # Don't leave callers waiting on a writer thread that is gone
+                    logger.exception("Write queue for %s failed", self.db_path)
+                    self._rollback(conn)
+                    for future, _ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    self._fail_pending(e)
+                    return
+                if stop:
+                    return
+        finally:
+            self._conn = None
+            conn.close()
+
+    def _fail_pending(self, error: Exception) -> None:
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and item[0].set_running_or_notify_cancel():
+                item[0].set_exception(error)
+
+    def stats(self) -> Dict[str, int]:
+        """Get operation, batch and failure counters and the current queue length"""
+        with self._lock:
+            return {
+                "operations": self.operations,
+                "batches": self.batches,
+                "failed_operations": self.failed_operations,
+                "queued": self._queue.qsize(),
+            }
+
+    def close(self, wait: bool = True) -> None:
+        """Stop accepting writes; already queued operations are still committed"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        if wait:
+            self._thread.join()
+
+    def after_fork(self) -> None:
+        """
+        Give the child process its own writer thread and connection
+        
+        Writes queued in the parent stay with the parent; the child starts with an empty queue.
+        """
+        abandon_inherited([self._conn])
+        self._conn = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        if not self._closed:
+            self._start_writer()
+
+
+class DatabaseRouter:
+    """
+    Route reads to a pool of read-only connections and writes to a WriteQueue
+
+    With the database in WAL mode readers see the last committed state and
+    never wait for the writer, while all writes go through the single writer
+    thread.
+
+    Parameters:
+        db_path: Path to the SQLite database file
+        read_pool_size: Maximum number of read-only connections
+        read_profile: TUNING_PROFILES entry for the read connections
+        write_profile: TUNING_PROFILES entry for the writer connection
+        on_connect: Optional callback run on every new read and write connection
+        write_options: Further WriteQueue options (max_batch_size, max_batch_delay)
+    """
+
+    def __init__(self, db_path: str, read_pool_size: int = 5, read_profile: Optional[str] = "read_heavy",
+                 write_profile: Optional[str] = "write_heavy",
+                 on_connect: Optional[Callable[[sqlite3.Connection], None]] = None, **write_options):
+        self.db_path = db_path
+        self.read_pool = ConnectionPool(db_path, max_size=read_pool_size, on_connect=on_connect,
+                                        profile=read_profile, read_only=True)
+        self.writer = WriteQueue(db_path, profile=write_profile, on_connect=on_connect, **write_options)
+
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Check a read-only connection out of the pool (context manager)"""
+        return self.read_pool.connection()
+
+    def write(self, query: str, params: tuple = ()) -> Future:
+        """Queue a write statement, see WriteQueue.execute"""
+        return self.writer.execute(query, params)
+
+    def write_many(self, query: str, seq_of_params: Iterable[tuple]) -> Future:
+        """Queue a statement run once per parameter tuple, see WriteQueue.executemany"""
+        return self.writer.executemany(query, seq_of_params)
+
+    def transaction(self, operation: Callable[[sqlite3.Connection], Any]) -> Future:
+        """Queue a callable running several statements atomically, see WriteQueue.submit"""
+        return self.writer.submit(operation)
+
+    def close(self) -> None:
+        """Commit queued writes, stop the writer and close the read connections"""
+        self.writer.close()
+        self.read_pool.close()
+
+
+# Number of rows pulled from SQLite per fetchmany() call when streaming results
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _column_names(cursor: sqlite3.Cursor) -> List[str]:
+    """Get the column names of the statement last executed on a cursor"""
+    return [description[0] for description in cursor.description] if cursor.description else []
+
+
+# Supported row representations:
+#   dict     - one dictionary per row (default)
+#   tuple    - plain tuples, in column order
+#   record   - namedtuple records, one record type per column signature
+#   row      - sqlite3.Row objects (index and name access)
+#   columnar - a single dict mapping each column name to a list of values
+ROW_FORMATS = ("dict", "tuple", "record", "row", "columnar")
+
+
+@lru_cache(maxsize=256)
+def _record_type(column_names: tuple) -> type:
+    """Get the namedtuple record type for a column signature, creating it once"""
+    return namedtuple("Record", column_names, rename=True)
+
+
+def _prepare_cursor(db_conn: sqlite3.Connection, row_format: str) -> sqlite3.Cursor:
+    """Create a cursor producing the raw rows needed for row_format"""
+    if row_format not in ROW_FORMATS:
+        raise ValueError(f"Row format '{row_format}' not supported. Use one of: {', '.join(ROW_FORMATS)}")
+    cursor = db_conn.cursor()
+    # Ignore any connection-level row factory so conversions always start from tuples
+    cursor.row_factory = sqlite3.Row if row_format == "row" else None
+    return cursor
+
+
+def _convert_rows(column_names: List[str], rows: List[Any], row_format: str) -> QueryResult:
+    """Convert a list of raw rows into the requested row format"""
+    if row_format == "dict":
+        return [dict(zip(column_names, row)) for row in rows]
+    if row_format == "record":
+        return list(map(_record_type(tuple(column_names))._make, rows))
+    if row_format == "columnar":
+        columns = list(zip(*rows)) if rows else [()] * len(column_names)
+        return {name: list(values) for name, values in zip(column_names, columns)}
+    # "tuple" and "row" are already produced by the cursor
+    return rows
+
+
+def _fetch_all(cursor: sqlite3.Cursor, row_format: str = "dict") -> QueryResult:
+    """Fetch every remaining row of a cursor in the requested row format"""
+    return _convert_rows(_column_names(cursor), cursor.fetchall(), row_format)
+
+
+def _fetch_batches(cursor: sqlite3.Cursor, batch_size: int, row_format: str = "dict") -> Iterator[QueryResult]:
+    """Fetch the remaining rows of a cursor lazily, batch_size rows at a time"""
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    column_names = _column_names(cursor)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield _convert_rows(column_names, rows, row_format)
+
+
+def _record_query(db_conn: sqlite3.Connection, query: str, params: Any, started: float,
+                  executed: float, result: QueryResult, row_format: str) -> None:
+    """Report a finished query to the active QueryMetrics, if any"""
+    metrics = _query_metrics
+    if metrics is None:
+        return
+    fetched = time.perf_counter()
+    rows = len(next(iter(result.values()), ())) if row_format == "columnar" else len(result)
+    metrics.record(db_conn, query, params, executed - started, fetched - executed, rows)
+
+
+def execute_safe_query(db_conn: sqlite3.Connection, query: str, params: tuple,
+                       row_format: str = "dict", cache: Optional["QueryCache"] = None) -> QueryResult:
     """
     Execute SQL query safely with parameterization
     
@@ -18,25 +711,91 @@ def execute_safe_query(db_conn: sqlite3.Connection, query: str, params: tuple) -
         db_conn: SQLite database connection
         query: SQL query with placeholders (?)
         params: Tuple of parameters to substitute in query
+        row_format: Row representation, one of ROW_FORMATS
+        cache: Optional QueryCache to serve repeated read queries from
         
     Returns:
-        List of dictionaries representing rows
+        List of dictionaries representing rows (or the representation selected by row_format)
     """
-    cursor = db_conn.cursor()
+    if cache is not None:
+        return cache.execute(db_conn, query, params, row_format)
+    cursor = _prepare_cursor(db_conn, row_format)
+    started = time.perf_counter()
     cursor.execute(query, params)
+    executed = time.perf_counter()
     
-    # Get column names
-    column_names = [description[0] for description in cursor.description] if cursor.description else []
+    results = _fetch_all(cursor, row_format)
+    _record_query(db_conn, query, params, started, executed, results, row_format)
+    return results
+
+
+def iter_safe_query_batches(db_conn: sqlite3.Connection, query: str, params: tuple,
+                            batch_size: int = DEFAULT_BATCH_SIZE,
+                            row_format: str = "dict") -> Iterator[QueryResult]:
+    """
+    Execute SQL query safely with parameterization and stream the results in batches
     
-    # Convert rows to dictionaries
-    results = []
-    for row in cursor.fetchall():
-        results.append(dict(zip(column_names, row)))
+    Rows are read with cursor.fetchmany(), so memory stays bounded by batch_size
+    no matter how many rows the query returns. The connection must stay open
+    (and checked out, when it comes from a ConnectionPool) until iteration ends.
     
-    return results
+    Parameters:
+        db_conn: SQLite database connection
+        query: SQL query with placeholders (?)
+        params: Tuple of parameters to substitute in query
+        batch_size: Number of rows fetched from SQLite per batch
+        row_format: Row representation, one of ROW_FORMATS
+        
+    Returns:
+        Generator of lists of dictionaries representing rows
+        (or the representation selected by row_format)
+    """
+    cursor = _prepare_cursor(db_conn, row_format)
+    started = time.perf_counter()
+    fetch_seconds = 0.0
+    rows = 0
+    try:
+        cursor.execute(query, params)
+        executed = time.perf_counter()
+        batches = _fetch_batches(cursor, batch_size, row_format)
+        while True:
+            fetch_started = time.perf_counter()
+            batch = next(batches, None)
+            fetch_seconds += time.perf_counter() - fetch_started
+            if batch is None:
+                break
+            rows += len(next(iter(batch.values()), ())) if row_format == "columnar" else len(batch)
+            yield batch
+        metrics = _query_metrics
+        if metrics is not None:
+            # Time spent by the consumer between batches is not counted
+            metrics.record(db_conn, query, params, executed - started, fetch_seconds, rows)
+    finally:
+        cursor.close()
+
 
+def iter_safe_query(db_conn: sqlite3.Connection, query: str, params: tuple,
+                    batch_size: int = DEFAULT_BATCH_SIZE, row_format: str = "dict") -> Iterator[Any]:
+    """
+    Execute SQL query safely with parameterization and stream the results row by row
+    
+    Parameters:
+        db_conn: SQLite database connection
+        query: SQL query with placeholders (?)
+        params: Tuple of parameters to substitute in query
+        batch_size: Number of rows fetched from SQLite at a time
+        row_format: Row representation, one of ROW_FORMATS except 'columnar'
+        
+    Returns:
+        Generator of dictionaries representing rows (or the representation selected by row_format)
+    """
+    if row_format == "columnar":
+        raise ValueError("Row format 'columnar' is only available for whole results or batches")
+    for batch in iter_safe_query_batches(db_conn, query, params, batch_size, row_format):
+        yield from batch
 
-def execute_unsafe_query(db_conn: sqlite3.Connection, query: str) -> List[Dict[str, Any]]:
+
+def execute_unsafe_query(db_conn: sqlite3.Connection, query: str, row_format: str = "dict") -> QueryResult:
     """
     Execute SQL query directly (VULNERABLE TO SQL INJECTION)
     
@@ -46,25 +805,23 @@ def execute_unsafe_query(db_conn: sqlite3.Connection, query: str) -> List[Dict[s
     Parameters:
         db_conn: SQLite database connection
         query: Raw SQL query string
+        row_format: Row representation, one of ROW_FORMATS
         
     Returns:
-        List of dictionaries representing rows
+        List of dictionaries representing rows (or the representation selected by row_format)
     """
-    cursor = db_conn.cursor()
+    cursor = _prepare_cursor(db_conn, row_format)
+    started = time.perf_counter()
     cursor.execute(query)  # SECURITY ISSUE: Direct execution of SQL query
+    executed = time.perf_counter()
     
-    # Get column names
-    column_names = [description[0] for description in cursor.description] if cursor.description else []
-    
-    # Convert rows to dictionaries
-    results = []
-    for row in cursor.fetchall():
-        results.append(dict(zip(column_names, row)))
-    
+    results = _fetch_all(cursor, row_format)
+    _record_query(db_conn, query, (), started, executed, results, row_format)
     return results
 
 
-def search_records_unsafe(db_conn: sqlite3.Connection, table_name: str, search_term: str) -> List[Dict[str, Any]]:
+def search_records_unsafe(db_conn: sqlite3.Connection, table_name: str, search_term: str,
+                          row_format: str = "dict") -> QueryResult:
     """
     Search records in a table using a search term (VULNERABLE TO SQL INJECTION)
     
@@ -74,32 +831,46 @@ def search_records_unsafe(db_conn: sqlite3.Connection, table_name: str, search_t
         db_conn: SQLite database connection
         table_name: Name of the table to search in
         search_term: Search term to use in the WHERE clause
+        row_format: Row representation, one of ROW_FORMATS
         
     Returns:
         List of dictionaries representing matching rows
     """
     # SECURITY ISSUE: String concatenation in SQL query
     query = f"SELECT * FROM {table_name} WHERE name LIKE '%{search_term}%'"
-    return execute_unsafe_query(db_conn, query)
+    return execute_unsafe_query(db_conn, query, row_format)
 
 
-def search_records_safe(db_conn: sqlite3.Connection, table_name: str, search_term: str) -> List[Dict[str, Any]]:
+def search_records_safe(db_conn: sqlite3.Connection, table_name: str, search_term: str,
+                        row_format: str = "dict", use_fts: bool = True) -> QueryResult:
     """
     Search records in a table using a search term (SAFE VERSION)
     
+    When the table has a full-text index built by create_fts_index, the LIKE
+    pattern is answered from the trigram index instead of scanning the table.
+    Without the index (or without FTS5 support) it falls back to a plain LIKE.
+    Both paths return the same rows.
+    
     Parameters:
         db_conn: SQLite database connection
         table_name: Name of the table to search in
         search_term: Search term to use in the WHERE clause
+        row_format: Row representation, one of ROW_FORMATS
+        use_fts: If True, use the table's full-text index when one exists
         
     Returns:
         List of dictionaries representing matching rows
     """
-    query = f"SELECT * FROM {table_name} WHERE name LIKE ?"
-    return execute_safe_query(db_conn, query, (f"%{search_term}%",))
+    if use_fts and has_fts_index(db_conn, table_name):
+        query = (f"SELECT * FROM {table_name} WHERE rowid IN "
+                 f"(SELECT rowid FROM {fts_table_name(table_name)} WHERE name LIKE ?)")
+    else:
+        query = f"SELECT * FROM {table_name} WHERE name LIKE ?"
+    return execute_safe_query(db_conn, query, (f"%{search_term}%",), row_format)
 
 
-def direct_query_unsafe(db_conn: sqlite3.Connection, table_name: str, user_input: str) -> List[Dict[str, Any]]:
+def direct_query_unsafe(db_conn: sqlite3.Connection, table_name: str, user_input: str,
+                        row_format: str = "dict") -> QueryResult:
     """
     Direct and highly dangerous query execution with user input
     
@@ -110,26 +881,26 @@ def direct_query_unsafe(db_conn: sqlite3.Connection, table_name: str, user_input
         db_conn: SQLite database connection
         table_name: Table name to query
         user_input: Raw user input directly injected into WHERE clause
+        row_format: Row representation, one of ROW_FORMATS
         
     Returns:
         List of dictionaries representing rows
     """
     # CRITICAL SECURITY ISSUE: Direct user input in WHERE clause with no sanitization
     query = f"SELECT * FROM {table_name} WHERE {user_input}"
-    cursor = db_conn.cursor()
+    cursor = _prepare_cursor(db_conn, row_format)
+    started = time.perf_counter()
     cursor.execute(query)  # Direct SQL injection vulnerability
+    executed = time.perf_counter()
     
-    column_names = [description[0] for description in cursor.description] if cursor.description else []
-    
-    results = []
-    for row in cursor.fetchall():
-        results.append(dict(zip(column_names, row)))
-    
+    results = _fetch_all(cursor, row_format)
+    _record_query(db_conn, query, (), started, executed, results, row_format)
     return results
 
 
 def direct_query_safe(db_conn: sqlite3.Connection, table_name: str, column_name: str, 
-                     operator: str, value: Any) -> List[Dict[str, Any]]:
+                     operator: str, value: Any, row_format: str = "dict",
+                     cache: Optional["QueryCache"] = None) -> QueryResult:
     """
     Safe alternative to direct_query_unsafe
     
@@ -137,16 +908,996 @@ def direct_query_safe(db_conn: sqlite3.Connection, table_name: str, column_name:
         db_conn: SQLite database connection
         table_name: Table name to query
         column_name: Column name to filter on
-        operator: SQL operator (=, >, <, etc.)
-        value: Value to compare against
+        operator: SQL operator, one of QUERY_OPERATORS
+        value: Value to compare against (a sequence for IN/NOT IN, a (low, high) pair for BETWEEN)
+        row_format: Row representation, one of ROW_FORMATS
+        cache: Optional QueryCache to serve repeated queries from
         
     Returns:
         List of dictionaries representing rows
     """
-    # Whitelist of allowed operators to prevent injection
-    allowed_operators = ['=', '>', '<', '>=', '<=', '!=', 'LIKE', 'IN', 'NOT IN']
-    if operator.upper() not in allowed_operators:
-        raise ValueError(f"Operator '{operator}' not allowed. Use one of: {', '.join(allowed_operators)}")
+    # Identifiers and the operator are whitelisted by the builder to prevent injection
+    return SelectQuery(table_name).where(column_name, operator, value).execute(db_conn, row_format, cache)
+
+# Operators accepted by SelectQuery.where() and direct_query_safe()
+QUERY_OPERATORS = ("=", ">", "<", ">=", "<=", "!=", "LIKE", "IN", "NOT IN", "BETWEEN")
+_LIST_OPERATORS = ("IN", "NOT IN")
+# ORDER BY term split into column and direction; the column is checked with _validate_identifier
+_ORDER_TERM_RE = re.compile(r"^\s*(\S+?)(?:\s+(ASC|DESC))?\s*$", re.IGNORECASE)
+
+
+def _in_list_size(count: int) -> int:
+    """Round an IN list length up to the next power of two so list lengths share a few query shapes"""
+    size = 1
+    while size < count:
+        size *= 2
+    return size if count else 0
+
+
+@lru_cache(maxsize=1024)
+def _select_sql(table_name: str, columns: tuple, predicates: tuple, order_by: tuple, has_limit: bool) -> str:
+    """
+    Render the SQL text of one query shape
+
+    predicates holds (columns, operator, placeholder count) triples, so queries
+    differing only in their values map to the same text, and so to the same
+    entry in SQLite's prepared statement cache.
+    """
+    sql = f"SELECT {', '.join(columns) if columns else '*'} FROM {table_name}"
+    conditions = []
+    for predicate_columns, operator, count in predicates:
+        if len(predicate_columns) == 1:
+            left, right = predicate_columns[0], "?"
+        else:
+            left = f"({', '.join(predicate_columns)})"
+            right = f"({', '.join('?' * count)})"
+        if operator in _LIST_OPERATORS:
+            right = f"({', '.join('?' * count)})"
+        elif operator == "BETWEEN":
+            right = "? AND ?"
+        conditions.append(f"{left} {operator} {right}")
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if order_by:
+        sql += " ORDER BY " + ", ".join(order_by)
+    if has_limit:
+        sql += " LIMIT ?"
+    return sql
+
+
+class SelectQuery:
+    """
+    Composable, parameterized SELECT on a single table
+
+    Table, column and ORDER BY names are checked to be plain identifiers and
+    operators are checked against QUERY_OPERATORS; every value is bound as a
+    parameter. IN/NOT IN lists are expanded into one placeholder per value,
+    padded (by repeating the last value) to a power-of-two length, and the
+    generated SQL text is cached per query shape, so repeated calls reuse
+    SQLite's prepared statements.
+
+    Example:
+        SelectQuery("products", ["id", "name", "price"]) \\
+            .where("category", "IN", ["Electronics", "Furniture"]) \\
+            .where(("price", "id"), ">", (100.0, 42)) \\
+            .order_by("price", "id") \\
+            .limit(20) \\
+            .execute(conn)
+
+    Parameters:
+        table_name: Table to select from
+        columns: Columns to return (default: all columns)
+    """
+
+    def __init__(self, table_name: str, columns: Optional[Sequence[str]] = None):
+        self.table_name = _validate_identifier(table_name)
+        self.columns = tuple(_validate_identifier(column) for column in columns or ())
+        self._predicates = []
+        self._params = []
+        self._order_by = ()
+        self._limit = None
+
+    def where(self, column: Union[str, Sequence[str]], operator: str, value: Any) -> "SelectQuery":
+        """
+        Add a condition, combined with the previous ones by AND
+
+        Parameters:
+            column: Column name, or a sequence of names for a row-value comparison
+                    such as (price, id) > (?, ?)
+            operator: One of QUERY_OPERATORS
+            value: Value to compare against; a sequence for IN/NOT IN, a (low, high)
+                   pair for BETWEEN, and a sequence of the same length for row values
+
+        Returns:
+            The query itself, for chaining
+        """
+        operator = operator.upper()
+        if operator not in QUERY_OPERATORS:
+            raise ValueError(f"Operator '{operator}' not allowed. Use one of: {', '.join(QUERY_OPERATORS)}")
+        columns = (column,) if isinstance(column, str) else tuple(column)
+        if not columns:
+            raise ValueError("At least one column is required")
+        columns = tuple(_validate_identifier(name) for name in columns)
+
+        if operator in _LIST_OPERATORS:
+            if len(columns) > 1:
+                raise ValueError(f"{operator} takes a single column")
+            values = [value] if isinstance(value, (str, bytes)) or not isinstance(value, Iterable) else list(value)
+            size = _in_list_size(len(values))
+            values += values[-1:] * (size - len(values))
+        elif operator == "BETWEEN":
+            values = list(value)
+            if len(columns) > 1 or len(values) != 2:
+                raise ValueError("BETWEEN takes a single column and a (low, high) pair")
+        elif len(columns) > 1:
+            values = list(value)
+            if len(values) != len(columns):
+                raise ValueError(f"Expected {len(columns)} values for {', '.join(columns)}")
+        else:
+            values = [value]
+
+        self._predicates.append((columns, operator, len(values)))
+        self._params.extend(values)
+        return self
+
+    def order_by(self, *terms: str) -> "SelectQuery":
+        """Set the sort order from column names, each optionally followed by ASC or DESC"""
+        order_by = []
+        for term in terms:
+            match = _ORDER_TERM_RE.match(term)
+            if not match:
+                raise ValueError(f"Invalid ORDER BY term '{term}'")
+            column, direction = match.groups()
+            _validate_identifier(column)
+            order_by.append(f"{column} DESC" if direction and direction.upper() == "DESC" else column)
+        self._order_by = tuple(order_by)
+        return self
+
+    def limit(self, count: Optional[int]) -> "SelectQuery":
+        """Return at most count rows (None removes the limit)"""
+        if count is not None and (not isinstance(count, int) or count < 0):
+            raise ValueError("limit must be a non-negative integer")
+        self._limit = count
+        return self
+
+    def build(self) -> tuple:
+        """
+        Render the query
+
+        Returns:
+            Tuple of (SQL text with placeholders, tuple of parameters)
+        """
+        sql = _select_sql(self.table_name, self.columns, tuple(self._predicates), self._order_by,
+                          self._limit is not None)
+        params = tuple(self._params) if self._limit is None else (*self._params, self._limit)
+        return sql, params
+
+    def execute(self, db_conn: sqlite3.Connection, row_format: str = "dict",
+                cache: Optional["QueryCache"] = None) -> QueryResult:
+        """Run the query with execute_safe_query"""
+        sql, params = self.build()
+        return execute_safe_query(db_conn, sql, params, row_format, cache)
+
+    def iter_batches(self, db_conn: sqlite3.Connection, batch_size: int = DEFAULT_BATCH_SIZE,
+                     row_format: str = "dict") -> Iterator[QueryResult]:
+        """Stream the query results with iter_safe_query_batches"""
+        sql, params = self.build()
+        return iter_safe_query_batches(db_conn, sql, params, batch_size, row_format)
+
+
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _validate_identifier(name: str) -> str:
+    """Make sure a table or column name is a plain identifier before it is put into SQL"""
+    if not isinstance(name, str) or not _IDENTIFIER_RE.match(name):
+        raise ValueError(f"Invalid SQL identifier '{name}'")
+    return name
+
+
+@lru_cache(maxsize=1)
+def fts5_available() -> bool:
+    """Check whether the local SQLite build supports FTS5 with the trigram tokenizer"""
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("CREATE VIRTUAL TABLE fts_probe USING fts5(value, tokenize='trigram')")
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+
+def fts_table_name(table_name: str) -> str:
+    """Get the name of the full-text index table shadowing a table"""
+    return f"{_validate_identifier(table_name)}_fts"
+
+
+def has_fts_index(db_conn: sqlite3.Connection, table_name: str) -> bool:
+    """Check whether a table has a usable full-text index"""
+    if not fts5_available():
+        return False
+    row = db_conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (fts_table_name(table_name),)
+    ).fetchone()
+    return row is not None
+
+
+def create_fts_index(db_conn: sqlite3.Connection, table_name: str, columns: tuple = ("name",)) -> bool:
+    """
+    Build a trigram FTS5 index over a table and keep it in sync with triggers
+    
+    The index is an external-content FTS5 table named <table>_fts, so the text
+    is not stored twice. The trigram tokenizer lets SQLite answer LIKE '%term%'
+    from the index, which keeps the substring semantics of the plain LIKE search.
+    Calling it again for an existing index is a no-op.
+    
+    Parameters:
+        db_conn: SQLite database connection
+        table_name: Name of the table to index
+        columns: Text columns to index (must include "name" for search_records_safe)
+        
+    Returns:
+        True if the index exists afterwards, False if FTS5 is not available
+    """
+    if not fts5_available():
+        return False
+    if has_fts_index(db_conn, table_name):
+        return True
+
+    fts_table = fts_table_name(table_name)
+    column_list = ", ".join(_validate_identifier(column) for column in columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+
+    cursor = db_conn.cursor()
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE {fts_table} USING fts5("
+        f"{column_list}, content='{table_name}', tokenize='trigram')"
+    )
+    cursor.execute(f"""
+    CREATE TRIGGER {fts_table}_ai AFTER INSERT ON {table_name} BEGIN
+        INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.rowid, {new_values});
+    END
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER {fts_table}_ad AFTER DELETE ON {table_name} BEGIN
+        INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) VALUES ('delete', old.rowid, {old_values});
+    END
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER {fts_table}_au AFTER UPDATE ON {table_name} BEGIN
+        INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) VALUES ('delete', old.rowid, {old_values});
+        INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.rowid, {new_values});
+    END
+    """)
+    # Index the rows that already exist
+    cursor.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+    db_conn.commit()
+    return True
+
+
+def drop_fts_index(db_conn: sqlite3.Connection, table_name: str) -> None:
+    """Drop a table's full-text index and its sync triggers"""
+    fts_table = fts_table_name(table_name)
+    cursor = db_conn.cursor()
+    for suffix in ("ai", "ad", "au"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}")
+    cursor.execute(f"DROP TABLE IF EXISTS {fts_table}")
+    db_conn.commit()
+
+
+# Quoted literals/identifiers are kept verbatim, whitespace elsewhere is collapsed
+_QUERY_TOKEN_RE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|\s+""")
+
+
+@lru_cache(maxsize=1024)
+def _normalize_query(query: str) -> str:
+    """Normalize whitespace in a query so equivalent query texts share a cache key"""
+    return _QUERY_TOKEN_RE.sub(lambda match: match.group(1) or " ", query).strip()
+
+
+class QueryCache:
+    """
+    LRU + TTL cache of read query results with write-aware invalidation
+    
+    Entries are keyed on the normalized query text, its parameters and the row
+    format. Before every lookup the cache reads PRAGMA data_version on a private
+    watcher connection; the value changes whenever any other connection (in this
+    or another process) commits to the database, and the whole cache is dropped
+    when it does. In-memory databases cannot be watched from a second connection,
+    so for ":memory:" the querying connection's total_changes is used instead.
+    
+    Only use the cache for read queries. Cached results are shared between
+    callers and must not be mutated.
+    
+    Parameters:
+        db_path: Path to the SQLite database the cached queries run against
+        max_entries: Maximum number of cached results before the least recently used is evicted
+        ttl: Seconds a cached result stays valid even if the database does not change
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 256, ttl: float = 60.0):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # key -> (expires_at, result), least recently used first
+        self._version = None
+        self._watcher = None
+        self._lock = threading.Lock()
+        register_after_fork(self)
+
+    def _read_version(self, db_conn: Optional[sqlite3.Connection]) -> Any:
+        """Read the current database version (caller holds the lock)"""
+        if self.db_path == ":memory:":
+            return (id(db_conn), db_conn.total_changes)
+        if self._watcher is None:
+            self._watcher = sqlite3.connect(self.db_path, check_same_thread=False)
+        return self._watcher.execute("PRAGMA data_version").fetchone()[0]
+
+    def _sync_version(self, db_conn: Optional[sqlite3.Connection]) -> Any:
+        """Drop every entry if the database changed since the last lookup (caller holds the lock)"""
+        version = self._read_version(db_conn)
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+            self._version = version
+        return version
+
+    def data_version(self) -> Any:
+        """Get the database version the cached entries are valid for"""
+        with self._lock:
+            if self.db_path == ":memory:":
+                return self._version
+            return self._sync_version(None)
+
+    def execute(self, db_conn: sqlite3.Connection, query: str, params: tuple,
+                row_format: str = "dict") -> QueryResult:
+        """
+        Execute a read query through the cache
+        
+        Parameters:
+            db_conn: SQLite database connection used on a cache miss
+            query: SQL query with placeholders (?)
+            params: Tuple of parameters to substitute in query
+            row_format: Row representation, one of ROW_FORMATS
+            
+        Returns:
+            Cached or freshly fetched query result
+        """
+        key = (_normalize_query(query), tuple(params), row_format)
+        try:
+            hash(key)
+        except TypeError:
+            # Unhashable parameters cannot be used as a cache key
+            with self._lock:
+                self.misses += 1
+            return execute_safe_query(db_conn, query, params, row_format)
+
+        with self._lock:
+            version = self._sync_version(db_conn)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+
+        result = execute_safe_query(db_conn, query, params, row_format)
+
+        with self._lock:
+            # Don't store a result if the database changed while it was being read
+            if self._sync_version(db_conn) == version:
+                self._entries[key] = (time.monotonic() + self.ttl, result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return result
+
+    def invalidate(self) -> None:
+        """Drop every cached result, e.g. after writes the watcher cannot see yet"""
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Get hit/miss/eviction counters and the current number of entries"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+    def close(self) -> None:
+        """Drop every cached result and close the watcher connection"""
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+
+    def after_fork(self) -> None:
+        """Leave the parent's watcher connection alone; the child opens its own on the next lookup"""
+        abandon_inherited([self._watcher])
+        self._watcher = None
+        # data_version values are only comparable on the same connection
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+
+
+def read_csv_rows(path: str, encoding: str = "utf-8") -> Iterator[Dict[str, str]]:
+    """Stream the rows of a CSV file with a header line as dictionaries"""
+    with open(path, newline="", encoding=encoding) as csv_file:
+        yield from csv.DictReader(csv_file)
+
+
+def read_jsonl_rows(path: str, encoding: str = "utf-8") -> Iterator[Dict[str, Any]]:
+    """Stream the objects of a JSON Lines file, skipping blank lines"""
+    with open(path, encoding=encoding) as jsonl_file:
+        for line in jsonl_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def bulk_load(db_conn: sqlite3.Connection, table_name: str, rows: Iterable[Any],
+              columns: Optional[Sequence[str]] = None, batch_size: int = 10000,
+              rebuild_indexes: bool = False, fast_pragmas: bool = True,
+              on_conflict: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Stream rows into a table in chunked transactions
+    
+    Rows are consumed lazily, batch_size at a time, and each chunk is inserted with
+    executemany() and committed on its own, so memory stays bounded by the chunk.
     
-    query = f"SELECT * FROM {table_name} WHERE {column_name} {operator} ?"
-    return execute_safe_query(db_conn, query, (value,))
+    Parameters:
+        db_conn: SQLite database connection
+        table_name: Table to insert into
+        rows: Iterable of dictionaries or of sequences in column order
+        columns: Column names; taken from the first row's keys when rows are dictionaries
+        batch_size: Number of rows inserted per transaction
+        rebuild_indexes: If True, drop the table's indexes before loading and recreate them afterwards
+        fast_pragmas: If True, apply BULK_LOAD_PRAGMAS during the load and restore them afterwards
+        on_conflict: Optional conflict resolution (ABORT, FAIL, IGNORE, REPLACE, ROLLBACK)
+        
+    Returns:
+        Dictionary with the number of rows and batches loaded, elapsed seconds and rows per second
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    _validate_identifier(table_name)
+    conflict_clauses = ["ABORT", "FAIL", "IGNORE", "REPLACE", "ROLLBACK"]
+    if on_conflict is not None and on_conflict.upper() not in conflict_clauses:
+        raise ValueError(f"Conflict clause '{on_conflict}' not allowed. Use one of: {', '.join(conflict_clauses)}")
+
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        return {"rows": 0, "batches": 0, "seconds": 0.0, "rows_per_second": 0.0}
+    rows = chain([first_row], rows)
+
+    from_dicts = isinstance(first_row, dict)
+    if columns is None:
+        if not from_dicts:
+            raise ValueError("columns must be given when rows are not dictionaries")
+        columns = list(first_row.keys())
+    columns = [_validate_identifier(column) for column in columns]
+    if from_dicts:
+        rows = (tuple(row.get(column) for column in columns) for row in rows)
+
+    verb = f"INSERT OR {on_conflict.upper()}" if on_conflict else "INSERT"
+    placeholders = ", ".join("?" for _ in columns)
+    query = f"{verb} INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+
+    if db_conn.in_transaction:
+        db_conn.commit()
+    previous_pragmas = _apply_pragmas(db_conn, BULK_LOAD_PRAGMAS) if fast_pragmas else {}
+    dropped_indexes = []
+    if rebuild_indexes:
+        # Automatic indexes (UNIQUE/PRIMARY KEY constraints) have no SQL and cannot be dropped
+        dropped_indexes = db_conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table_name,)
+        ).fetchall()
+        for index_name, _ in dropped_indexes:
+            db_conn.execute(f'DROP INDEX "{index_name}"')
+        db_conn.commit()
+
+    loaded = 0
+    batches = 0
+    start = time.perf_counter()
+    try:
+        cursor = db_conn.cursor()
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                break
+            cursor.executemany(query, chunk)
+            db_conn.commit()
+            loaded += len(chunk)
+            batches += 1
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        for _, index_sql in dropped_indexes:
+            db_conn.execute(index_sql)
+        db_conn.commit()
+        if previous_pragmas:
+            _apply_pragmas(db_conn, previous_pragmas)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "rows": loaded,
+        "batches": batches,
+        "seconds": elapsed,
+        "rows_per_second": loaded / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def bulk_load_csv(db_conn: sqlite3.Connection, table_name: str, path: str, **options) -> Dict[str, Any]:
+    """Bulk load a CSV file with a header line into a table (see bulk_load for options)"""
+    return bulk_load(db_conn, table_name, read_csv_rows(path), **options)
+
+
+def bulk_load_jsonl(db_conn: sqlite3.Connection, table_name: str, path: str, **options) -> Dict[str, Any]:
+    """Bulk load a JSON Lines file of objects into a table (see bulk_load for options)"""
+    return bulk_load(db_conn, table_name, read_jsonl_rows(path), **options)
+
+
+def explain_query_plan(db_conn: sqlite3.Connection, query: str, params: Any = ()) -> List[str]:
+    """
+    Get the EXPLAIN QUERY PLAN steps of a query
+
+    Parameters:
+        db_conn: SQLite database connection
+        query: SQL query with placeholders (?)
+        params: Parameters the query would run with
+
+    Returns:
+        List of plan details, e.g. ["SEARCH products USING INDEX idx_products_category (category=?)"]
+    """
+    return [row[-1] for row in db_conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()]
+
+
+# Plan steps that visit every row of a table, e.g. "SCAN products" or (before SQLite 3.36) "SCAN TABLE products"
+_FULL_SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+_PLACEHOLDER_RE = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|(\?)""")
+_FROM_RE = re.compile(r"\bFROM\s+(\w+)", re.IGNORECASE)
+_SELECT_LIST_RE = re.compile(r"^\s*SELECT\s+(?:DISTINCT\s+)?(.*?)\s+FROM\b", re.IGNORECASE | re.DOTALL)
+_WHERE_RE = re.compile(r"\bWHERE\b(.*?)(?:\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL)
+_ORDER_BY_RE = re.compile(r"\bORDER\s+BY\b(.*?)(?:\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL)
+_EQUALITY_RE = re.compile(r"\b(\w+)\s*(?:==?|\bIS\b(?!\s+NOT\b)|\bIN\b)", re.IGNORECASE)
+_RANGE_RE = re.compile(r"\b(\w+)\s*(?:<|>|\bBETWEEN\b)|\(\s*(\w+)\s*,[^()]*\)\s*[<>]", re.IGNORECASE)
+
+
+def find_full_scans(plan: Sequence[str]) -> List[str]:
+    """
+    Get the tables a query plan reads in full
+
+    Index scans (SCAN ... USING INDEX) and virtual tables are not counted.
+
+    Parameters:
+        plan: Plan details as returned by explain_query_plan
+
+    Returns:
+        Names of the fully scanned tables, in plan order
+    """
+    tables = []
+    for step in plan:
+        match = _FULL_SCAN_RE.match(step.strip())
+        if match and match.group(1) != "CONSTANT":
+            tables.append(match.group(1))
+    return tables
+
+
+def _placeholder_params(query: str) -> tuple:
+    """Build a parameter tuple of NULLs with one value per ? placeholder in a query"""
+    return (None,) * sum(1 for match in _PLACEHOLDER_RE.finditer(query) if match.group(1))
+
+
+def _table_columns(db_conn: sqlite3.Connection, table_name: str) -> Dict[str, bool]:
+    """Map each column of a table to whether it is the INTEGER PRIMARY KEY (rowid alias)"""
+    info = db_conn.execute(f"PRAGMA table_info({_validate_identifier(table_name)})").fetchall()
+    primary_keys = [row[1] for row in info if row[5]]
+    return {
+        row[1]: len(primary_keys) == 1 and row[5] == 1 and row[2].upper() == "INTEGER"
+        for row in info
+    }
+
+
+def _index_columns(db_conn: sqlite3.Connection, table_name: str) -> List[List[str]]:
+    """Get the column lists of all indexes on a table"""
+    indexes = []
+    for index in db_conn.execute(f"PRAGMA index_list({_validate_identifier(table_name)})").fetchall():
+        info = db_conn.execute(f"PRAGMA index_info({_validate_identifier(index[1])})").fetchall()
+        indexes.append([row[2] for row in sorted(info)])
+    return indexes
+
+
+def suggest_index(db_conn: sqlite3.Connection, query: str, covering: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Propose an index for a single-table query
+
+    Columns compared with = or IN come first, followed by the ORDER BY columns
+    (when they can follow the equality columns without a separate sort) or else
+    the first column with a range condition (<, >, BETWEEN or a row-value
+    comparison). The query text is only inspected, never run.
+
+    Parameters:
+        db_conn: SQLite database connection
+        query: SELECT query with placeholders (?)
+        covering: If True, append the remaining selected columns so the query can be answered
+                  from the index alone (only when the query does not SELECT *)
+
+    Returns:
+        Dictionary with the table, the index columns, the index name and the CREATE INDEX
+        statement, or None if no useful index could be derived or an equivalent one exists
+    """
+    from_match = _FROM_RE.search(query)
+    if not from_match:
+        return None
+    table = from_match.group(1)
+    known = _table_columns(db_conn, table)
+    if not known:
+        return None
+
+    def columns_in(clause_match, pattern):
+        if not clause_match:
+            return []
+        found = []
+        for match in pattern.finditer(clause_match.group(1)):
+            column = next((group for group in match.groups() if group), None)
+            if column in known and column not in found:
+                found.append(column)
+        return found
+
+    where = _WHERE_RE.search(query)
+    equality = columns_in(where, _EQUALITY_RE)
+    ranges = [column for column in columns_in(where, _RANGE_RE) if column not in equality]
+    order_match = _ORDER_BY_RE.search(query)
+    order_by = []
+    if order_match:
+        for term in order_match.group(1).split(","):
+            column = re.sub(r"\s+(?:ASC|DESC)\s*$", "", term.strip(), flags=re.IGNORECASE)
+            if column not in known:
+                order_by = []  # expressions can't be served by a plain column index
+                break
+            if column not in equality:
+                order_by.append(column)
+
+    columns = list(equality)
+    if order_by and (not ranges or order_by[0] == ranges[0]):
+        columns.extend(order_by)
+    elif ranges:
+        columns.append(ranges[0])
+    if covering:
+        select_match = _SELECT_LIST_RE.search(query)
+        if select_match and select_match.group(1).strip() != "*":
+            selected = [column.strip() for column in select_match.group(1).split(",")]
+            other_columns = columns_in(where, re.compile(r"\b(\w+)\b"))
+            columns.extend(column for column in selected + other_columns if column in known)
+
+    # The rowid is part of every index already
+    columns = [column for column in dict.fromkeys(columns) if not known[column]]
+    if not columns:
+        return None
+    if any(existing[:len(columns)] == columns for existing in _index_columns(db_conn, table)):
+        return None
+    name = f"idx_{table}_{'_'.join(columns)}"
+    return {
+        "table": table,
+        "columns": columns,
+        "name": name,
+        "sql": f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})",
+    }
+
+
+def advise_indexes(db_conn: sqlite3.Connection, workload: Iterable[Union[str, Sequence[Any]]],
+                   create: bool = False, covering: bool = False) -> List[Dict[str, Any]]:
+    """
+    Check a workload of query templates for full table scans and propose indexes
+
+    Every query is run through EXPLAIN QUERY PLAN. Queries that scan a table
+    or sort through a temporary B-tree get an index proposal from
+    suggest_index(). A proposal whose columns are a leading prefix of another
+    proposal (or of an existing index) on the same table is replaced by the
+    longer index, so no redundant index is created. With create=True the
+    proposed indexes are created and the queries are explained again.
+
+    Parameters:
+        db_conn: SQLite database connection
+        workload: Query strings, or (query, params) pairs; placeholders of bare strings are bound to NULL
+        create: If True, create the proposed indexes
+        covering: Passed on to suggest_index
+
+    Returns:
+        One dictionary per query with its plan, the fully scanned tables, whether it
+        needs a temporary B-tree, the proposed index (or None) and, with create=True,
+        the plan after the indexes were created
+    """
+    report = []
+    for entry in workload:
+        query, params = (entry, None) if isinstance(entry, str) else entry
+        if params is None:
+            params = _placeholder_params(query)
+        plan = explain_query_plan(db_conn, query, params)
+        full_scans = find_full_scans(plan)
+        temp_b_tree = any("USE TEMP B-TREE" in step for step in plan)
+        suggestion = suggest_index(db_conn, query, covering) if full_scans or temp_b_tree else None
+        report.append({
+            "query": _normalize_query(query),
+            "params": params,
+            "plan": plan,
+            "full_scans": full_scans,
+            "temp_b_tree": temp_b_tree,
+            "suggested_index": suggestion,
+        })
+
+    # An index whose columns lead another proposal (or an existing index) is redundant:
+    # point its queries at the longer index instead of proposing both
+    proposals = {item["suggested_index"]["name"]: item["suggested_index"]
+                 for item in report if item["suggested_index"]}
+    for item in report:
+        suggestion = item["suggested_index"]
+        if suggestion is None:
+            continue
+        columns = suggestion["columns"]
+        if any(existing[:len(columns)] == columns for existing in _index_columns(db_conn, suggestion["table"])):
+            item["suggested_index"] = None
+            continue
+        superseding = [other for other in proposals.values()
+                       if other["table"] == suggestion["table"] and len(other["columns"]) > len(columns)
+                       and other["columns"][:len(columns)] == columns]
+        if superseding:
+            item["suggested_index"] = max(superseding, key=lambda other: len(other["columns"]))
+
+    if create:
+        created = set()
+        for item in report:
+            suggestion = item["suggested_index"]
+            if suggestion and suggestion["name"] not in created:
+                db_conn.execute(suggestion["sql"])
+                created.add(suggestion["name"])
+        db_conn.commit()
+        for item in report:
+            item["plan_after"] = explain_query_plan(db_conn, item["query"], item["params"])
+    return report
+
+
+def assert_no_full_scan(db_conn: sqlite3.Connection, query: str, params: Optional[Any] = None,
+                        tables: Optional[Sequence[str]] = None, allow_sort: bool = True) -> List[str]:
+    """
+    Fail if a query's plan reads a whole table
+
+    Meant for tests guarding hot queries against plan regressions.
+
+    Parameters:
+        db_conn: SQLite database connection
+        query: SQL query with placeholders (?)
+        params: Parameters to explain the query with (defaults to NULL for every placeholder)
+        tables: Only fail for scans of these tables (default: any table)
+        allow_sort: If False, also fail if the plan sorts with a temporary B-tree, i.e. reads
+                    every matching row before returning the first one (e.g. a LIMIT query
+                    whose ORDER BY is not served by the index it searches)
+
+    Returns:
+        The query plan
+
+    Raises:
+        AssertionError: If the plan contains a full scan of a checked table, or a sort
+                        when allow_sort is False
+    """
+    if params is None:
+        params = _placeholder_params(query)
+    plan = explain_query_plan(db_conn, query, params)
+    scanned = [table for table in find_full_scans(plan) if tables is None or table in tables]
+    if scanned:
+        raise AssertionError(
+            f"Query scans {', '.join(scanned)}: {_normalize_query(query)}\n  " + "\n  ".join(plan)
+        )
+    if not allow_sort and any(step.strip().startswith("USE TEMP B-TREE") for step in plan):
+        raise AssertionError(f"Query sorts with a temporary B-tree: {_normalize_query(query)}\n  " + "\n  ".join(plan))
+    return plan
+
+
+class _StatementStats:
+    """Counters for one normalized statement"""
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.slow_calls = 0
+        self.latency = Histogram()
+        self.execute_time = Histogram()
+        self.fetch_time = Histogram()
+
+
+class QueryMetrics:
+    """
+    Query instrumentation and slow-query log for sql_utils
+
+    Once installed with set_query_metrics(), every query run through
+    execute_safe_query, iter_safe_query(_batches), execute_unsafe_query and
+    direct_query_unsafe is recorded per normalized statement: call count, rows
+    returned and latency histograms for the whole query, for cursor.execute()
+    and for fetching the rows. Queries slower than slow_query_threshold are
+    logged at WARNING level with their EXPLAIN QUERY PLAN. Parameter values are
+    never logged.
+
+    instrument_connection() additionally installs a trace callback and a
+    progress handler on a connection, counting every statement SQLite runs on
+    it (including ones issued outside sql_utils) and the virtual machine steps
+    they take.
+
+    Parameters:
+        slow_query_threshold: Seconds after which a query is logged as slow (None disables the log)
+        explain_slow_queries: If True, include the query plan in slow-query log entries
+        progress_interval: Number of SQLite VM instructions per progress handler call
+        max_statements: Distinct statements tracked individually; any further ones
+                        (e.g. literal SQL built by the unsafe helpers) share one "<other>" entry
+    """
+
+    def __init__(self, slow_query_threshold: Optional[float] = 0.1, explain_slow_queries: bool = True,
+                 progress_interval: int = 1000, max_statements: int = 500):
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_slow_queries = explain_slow_queries
+        self.progress_interval = progress_interval
+        self.max_statements = max_statements
+        self.traced_statements = 0
+        self.vm_steps = 0
+        self._statements = {}
+        self._lock = threading.Lock()
+        register_after_fork(self)
+
+    def record(self, db_conn: sqlite3.Connection, query: str, params: Any, execute_seconds: float,
+               fetch_seconds: float, rows: int) -> None:
+        """
+        Record one finished query
+
+        Parameters:
+            db_conn: Connection the query ran on (used to explain slow queries)
+            query: SQL query text
+            params: Parameters the query ran with
+            execute_seconds: Time spent in cursor.execute()
+            fetch_seconds: Time spent fetching and converting rows
+            rows: Number of rows returned
+        """
+        statement = _normalize_query(query)
+        total_seconds = execute_seconds + fetch_seconds
+        slow = self.slow_query_threshold is not None and total_seconds >= self.slow_query_threshold
+        with self._lock:
+            stats = self._statements.get(statement)
+            if stats is None:
+                if len(self._statements) >= self.max_statements:
+                    statement = "<other>"
+                stats = self._statements.get(statement)
+                if stats is None:
+                    stats = self._statements[statement] = _StatementStats()
+            stats.calls += 1
+            stats.rows += rows
+            if slow:
+                stats.slow_calls += 1
+        stats.latency.observe(total_seconds)
+        stats.execute_time.observe(execute_seconds)
+        stats.fetch_time.observe(fetch_seconds)
+
+        if slow:
+            plan = ""
+            if self.explain_slow_queries:
+                try:
+                    plan = "\n  " + "\n  ".join(explain_query_plan(db_conn, query, params))
+                except sqlite3.Error as e:
+                    plan = f"\n  (query plan unavailable: {e})"
+            logger.warning(
+                "Slow query: %.1f ms (execute %.1f ms, fetch %.1f ms), %d rows: %s%s",
+                total_seconds * 1000, execute_seconds * 1000, fetch_seconds * 1000, rows, statement, plan
+            )
+
+    def _count_statement(self, statement: str) -> None:
+        with self._lock:
+            self.traced_statements += 1
+
+    def _count_progress(self) -> int:
+        with self._lock:
+            self.vm_steps += self.progress_interval
+        return 0  # keep the statement running
+
+    def instrument_connection(self, db_conn: sqlite3.Connection) -> None:
+        """Count every statement and VM step SQLite runs on a connection"""
+        db_conn.set_trace_callback(self._count_statement)
+        db_conn.set_progress_handler(self._count_progress, self.progress_interval)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get all recorded metrics as a JSON-serializable dictionary"""
+        with self._lock:
+            statements = list(self._statements.items())
+            totals = {"traced_statements": self.traced_statements, "vm_steps": self.vm_steps}
+        totals["statements"] = {
+            statement: {
+                "calls": stats.calls,
+                "rows": stats.rows,
+                "slow_calls": stats.slow_calls,
+                "latency": stats.latency.snapshot(),
+                "execute_time": stats.execute_time.snapshot(),
+                "fetch_time": stats.fetch_time.snapshot(),
+            }
+            for statement, stats in statements
+        }
+        return totals
+
+    def to_prometheus(self) -> str:
+        """Render all recorded metrics in the Prometheus text exposition format"""
+        with self._lock:
+            statements = list(self._statements.items())
+            traced_statements = self.traced_statements
+            vm_steps = self.vm_steps
+        lines = [
+            "# TYPE sqlite_traced_statements_total counter",
+            f"sqlite_traced_statements_total {traced_statements}",
+            "# TYPE sqlite_vm_steps_total counter",
+            f"sqlite_vm_steps_total {vm_steps}",
+            "# TYPE sqlite_query_calls_total counter",
+        ]
+        lines.extend(f"sqlite_query_calls_total{format_labels({'statement': statement})} {stats.calls}"
+                     for statement, stats in statements)
+        lines.append("# TYPE sqlite_query_rows_total counter")
+        lines.extend(f"sqlite_query_rows_total{format_labels({'statement': statement})} {stats.rows}"
+                     for statement, stats in statements)
+        lines.append("# TYPE sqlite_slow_queries_total counter")
+        lines.extend(f"sqlite_slow_queries_total{format_labels({'statement': statement})} {stats.slow_calls}"
+                     for statement, stats in statements)
+        for metric, attribute in (("sqlite_query_duration_seconds", "latency"),
+                                  ("sqlite_query_execute_seconds", "execute_time"),
+                                  ("sqlite_query_fetch_seconds", "fetch_time")):
+            lines.append(f"# TYPE {metric} histogram")
+            for statement, stats in statements:
+                lines.extend(getattr(stats, attribute).prometheus_lines(metric, {"statement": statement}))
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Forget everything recorded so far"""
+        with self._lock:
+            self._statements = {}
+            self.traced_statements = 0
+            self.vm_steps = 0
+
+    def after_fork(self) -> None:
+        """Start a forked worker with empty metrics, so each process reports only its own queries"""
+        self._lock = threading.Lock()
+        self.reset()
+
+
+# Metrics receiving every instrumented query; None disables instrumentation
+_query_metrics: Optional[QueryMetrics] = None
+
+
+def set_query_metrics(metrics: Optional[QueryMetrics]) -> None:
+    """Install the QueryMetrics that sql_utils queries report to (None to turn instrumentation off)"""
+    global _query_metrics
+    _query_metrics = metrics
+
+
+def get_query_metrics() -> Optional[QueryMetrics]:
+    """Get the installed QueryMetrics, if any"""
+    return _query_metrics
@@ -1,6 +1,13 @@
 """
 Utility functions shared across projects.
 """
+import re
+
+# Compiled once at import instead of on every validate_email call
+EMAIL_PATTERN = re.compile(r'^[\w\.-]+@[\w\.-]+\.\w+$')
+
+# Maximum number of distinct values remembered by the batch helpers
+DEFAULT_MEMO_SIZE = 65536
 
 def format_string(text, uppercase=False):
     """Format string by removing extra spaces and optionally converting to uppercase"""
@@ -15,9 +22,50 @@ def calculate_average(numbers):
 
 def validate_email(email):
     """Simple email validation"""
-    import re
-    pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
-    return bool(re.match(pattern, email))
+    return EMAIL_PATTERN.match(email) is not None
+
+def format_strings(texts, uppercase=False, memo_size=DEFAULT_MEMO_SIZE):
+    """
+    Format a whole column of strings like format_string
+
+    Repeated values are formatted once: results are remembered for up to
+    memo_size distinct inputs. Returns a list in input order.
+    """
+    memo = {}
+    result = []
+    append = result.append
+    join = " ".join
+    for text in texts:
+        formatted = memo.get(text)
+        if formatted is None:
+            formatted = join(text.split())
+            if uppercase:
+                formatted = formatted.upper()
+            if len(memo) < memo_size:
+                memo[text] = formatted
+        append(formatted)
+    return result
+
+def validate_emails(emails, memo_size=DEFAULT_MEMO_SIZE):
+    """
+    Validate a whole column of emails like validate_email
+
+    Returns a compact boolean mask: a bytearray with 1 for each valid email and
+    0 otherwise, in input order. Repeated values are checked once, remembering
+    up to memo_size distinct inputs.
+    """
+    match = EMAIL_PATTERN.match
+    memo = {}
+    mask = bytearray()
+    append = mask.append
+    for email in emails:
+        valid = memo.get(email)
+        if valid is None:
+            valid = 0 if match(email) is None else 1
+            if len(memo) < memo_size:
+                memo[email] = valid
+        append(valid)
+    return mask
 
 def insecure_db_query(user_input):
     """
@@ -3,35 +3,45 @@ Project 1: User Data Processing Example
 """
 import sys
 import os
+from itertools import compress
 
 # Add the parent directory to sys.path to import the lib package
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from lib.utils import format_string, validate_email, process_user_input
-from lib.data_processing import filter_data, group_by
+from lib.utils import format_strings, validate_emails, process_user_input
+from lib.data_processing import group_by, reduce_by_key, Count
+
+def age_group(user):
+    """Age range bucket of a user"""
+    age = user.get('age', 0)
+    if age < 18:
+        return "under_18"
+    elif age < 30:
+        return "18_29"
+    elif age < 50:
+        return "30_49"
+    else:
+        return "50_plus"
+
+def _clean_valid_users(users):
+    """Clean user names in place and return the users with valid emails"""
+    # Clean user names as one column
+    names = format_strings(user['name'] for user in users)
+    for user, name in zip(users, names):
+        user['name'] = name
+    
+    # Filter valid users (those with valid emails) through a boolean mask
+    valid_mask = validate_emails(user.get('email', '') for user in users)
+    return compress(users, valid_mask)
 
 def process_user_data(users):
     """Process a list of user data"""
-    # Clean user names
-    for user in users:
-        user['name'] = format_string(user['name'])
-    
-    # Filter valid users (those with valid emails)
-    valid_users = filter_data(users, lambda user: validate_email(user.get('email', '')))
-    
     # Group users by age range
-    def age_group(user):
-        age = user.get('age', 0)
-        if age < 18:
-            return "under_18"
-        elif age < 30:
-            return "18_29"
-        elif age < 50:
-            return "30_49"
-        else:
-            return "50_plus"
-    
-    return group_by(valid_users, age_group)
+    return group_by(_clean_valid_users(users), age_group)
+
+def count_users_by_age_group(users):
+    """Count valid users per age range without keeping the users of each group"""
+    return reduce_by_key(_clean_valid_users(users), age_group, Count())
 
 if __name__ == "__main__":
     # Example data
@@ -6,7 +6,7 @@ import os
 
 # Add the lib directory to the path so we can import sql_utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from lib.sql_utils import connect_to_db, search_records_safe, execute_safe_query
+from lib.sql_utils import connect_to_db, search_records_safe, execute_safe_query, create_fts_index
 
 def setup_demo_database(db_path: str):
     """Set up a demo database with a products table"""
@@ -36,6 +36,9 @@ def setup_demo_database(db_path: str):
     ''')
     
     conn.commit()
+    
+    # Index product names so substring searches don't scan the whole table
+    create_fts_index(conn, "products")
     return conn
 
 def safe_search_example():
@@ -3,20 +3,60 @@ Project1: Application demonstrating secure SQL practices
 """
 import sys
 import os
-from flask import Flask, request, jsonify
+import base64
+import heapq
+import json
+from contextlib import ExitStack, closing
+from itertools import chain, islice
+from operator import itemgetter
+from flask import Blueprint, Flask, request, jsonify
 
 # Add the lib directory to the path so we can import sql_utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from lib.sql_utils import connect_to_db, execute_safe_query, direct_query_safe
+from lib.sql_utils import (
+    connect_to_db, SelectQuery, DatabaseRouter, QueryCache, bulk_load,
+    QueryMetrics, set_query_metrics, assert_no_full_scan, DEFAULT_BATCH_SIZE
+)
+from lib.json_stream import JSON_MIMETYPE, negotiate_mimetype, stream_rows_response
+from lib.metrics import install_request_metrics
+from lib.response_cache import ResponseCache
+from lib.serving import serve_prefork
 
-app = Flask(__name__)
+# Routes live on a blueprint so create_app() can build a fresh app in every worker process
+api = Blueprint('api', __name__)
 
-# Connect to database
-DB_PATH = os.path.join(os.path.dirname(__file__), 'secure_data.db')
+# Connect to database (SECURE_APP_DB overrides the location, e.g. for benchmarks)
+DB_PATH = os.environ.get('SECURE_APP_DB', os.path.join(os.path.dirname(__file__), 'secure_data.db'))
+
+# Keyset pagination page sizes for the product listing routes. JSON pages of up to
+# MAX_BUFFERED_PAGE_SIZE products are served through the query cache in one piece;
+# larger pages and every NDJSON response are streamed straight off the cursor.
+DEFAULT_PAGE_SIZE = 100
+MAX_BUFFERED_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 100000
+
+# Seconds a request waits for its queued write to be committed
+WRITE_TIMEOUT = 10.0
+
+# Record latency, rows and slow queries for every query run through sql_utils
+query_metrics = QueryMetrics(slow_query_threshold=0.1)
+set_query_metrics(query_metrics)
+
+# Reads use a pool of read-only connections; writes are queued to a single writer
+# thread that group-commits them. In WAL mode readers never wait on the writer.
+db_router = DatabaseRouter(DB_PATH, on_connect=query_metrics.instrument_connection)
+db_pool = db_router.read_pool
+
+# The catalog is read far more often than written; the cache drops itself on any commit
+query_cache = QueryCache(DB_PATH)
+
+# Clients poll the listings; an unchanged page is answered with 304 Not Modified (or
+# its cached body) from memory, without running the query or encoding JSON again
+response_cache = ResponseCache(DB_PATH)
 
 def initialize_database():
     """Initialize the database with sample data"""
-    conn = connect_to_db(DB_PATH)
+    conn = connect_to_db(DB_PATH, profile='write_heavy')
     cursor = conn.cursor()
     
     # Create products table
@@ -30,6 +70,11 @@ def initialize_database():
     )
     ''')
     
+    # Indexes backing the keyset-paginated listings
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_price ON products (price)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category, price)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_category ON products (category)')
+    
     # Insert sample data
     sample_data = [
         (1, 'Smartphone', 'Electronics', 699.99, 50),
@@ -39,83 +84,329 @@ def initialize_database():
         (5, 'Desk Chair', 'Furniture', 179.99, 30)
     ]
     
-    cursor.executemany(
-        'INSERT OR IGNORE INTO products (id, name, category, price, inventory) VALUES (?, ?, ?, ?, ?)', 
-        sample_data
+    bulk_load(
+        conn, 'products', sample_data,
+        columns=['id', 'name', 'category', 'price', 'inventory'], on_conflict='IGNORE'
     )
     
-    conn.commit()
     conn.close()
 
-# Extract the secure function without the decorator to make it visible to SonarQube
-def secure_product_query(category=None, min_price=None, max_price=None):
+# Columns returned by the product listing routes
+PRODUCT_COLUMNS = ('id', 'name', 'category', 'price', 'inventory')
+
+def _paginate(rows, limit, key_columns):
+    """Split rows fetched with LIMIT limit + 1 into the page and the keyset of its last row"""
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, [page[-1][column] for column in key_columns]
+
+def _category_list(category):
+    """Normalize a category argument (a name, a list of names or None) to a list of distinct names"""
+    if isinstance(category, str):
+        return [category]
+    return list(dict.fromkeys(name for name in category or () if name))
+
+def product_listing_query(category=None, price_range=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    """Build the (price, id) ordered listing query, fetching one row more than a page"""
+    query = SelectQuery('products', PRODUCT_COLUMNS)
+    if category is not None:
+        query.where('category', '=', category)
+    if price_range is not None:
+        query.where('price', 'BETWEEN', price_range)
+    if after is not None:
+        query.where(('price', 'id'), '>', after)
+    return query.order_by('price', 'id').limit(limit + 1)
+
+def product_id_listing_query(category=None, after_id=0, limit=DEFAULT_PAGE_SIZE):
+    """Build the id ordered listing query, fetching one row more than a page"""
+    query = SelectQuery('products', PRODUCT_COLUMNS)
+    if category is not None:
+        query.where('category', '=', category)
+    return query.where('id', '>', after_id).order_by('id').limit(limit + 1)
+
+def _per_category(build, categories, *args):
     """
-    This function demonstrates proper SQL parameterization.
-    SonarQube should be able to analyze this more easily.
+    Build one listing query per category (a single unfiltered one without categories)
+    
+    category IN (...) can't walk an index in listing order, so SQLite would sort
+    every matching row for each page; each per-category query walks its index
+    and stops after one page, and the pages are merged in listing order.
     """
-    conn = connect_to_db(DB_PATH)
+    return [build(category, *args) for category in categories or [None]]
+
+def _merge_pages(pages, limit, key_columns):
+    """Merge per-category pages, each in listing order, into the first limit + 1 rows overall"""
+    if len(pages) == 1:
+        return pages[0]
+    return list(islice(heapq.merge(*pages, key=itemgetter(*key_columns)), limit + 1))
+
+# Query shapes behind the listing endpoints; each one must walk an index in listing order
+HOT_QUERIES = [
+    product_listing_query(),
+    product_listing_query(after=[0.0, 0]),
+    product_listing_query('Electronics'),
+    product_listing_query('Electronics', after=[0.0, 0]),
+    product_listing_query('Electronics', (0.0, 1000.0)),
+    product_listing_query('Electronics', (0.0, 1000.0), [0.0, 0]),
+    product_id_listing_query(),
+    product_id_listing_query('Electronics'),
+    product_id_listing_query('Electronics', 100),
+]
+
+def check_query_plans():
+    """Raise AssertionError if one of the HOT_QUERIES has regressed to a full table scan or a sort"""
+    conn = connect_to_db(DB_PATH, read_only=True)
     try:
-        if category and min_price and max_price:
-            # Using parameterized queries for all user inputs
-            query = "SELECT * FROM products WHERE category = ? AND price BETWEEN ? AND ?"
-            results = execute_safe_query(conn, query, (category, float(min_price), float(max_price)))
-        elif category:
-            # Safely query by category
-            results = execute_safe_query(conn, "SELECT * FROM products WHERE category = ?", (category,))
-        else:
-            # Get all products
-            results = execute_safe_query(conn, "SELECT * FROM products", ())
-        
-        return results
+        for query in HOT_QUERIES:
+            assert_no_full_scan(conn, *query.build(), allow_sort=False)
     finally:
         conn.close()
 
-# This is an alternative implementation showing direct_query_safe
-def secure_product_query_alt(category=None):
+def secure_product_listing_queries(category=None, min_price=None, max_price=None, limit=DEFAULT_PAGE_SIZE,
+                                   after=None):
+    """Build the parameterized (price, id) listing queries for the request arguments, one per category"""
+    categories = _category_list(category)
+    price_range = None
+    if categories and min_price and max_price:
+        # Using parameterized queries for all user inputs
+        price_range = (float(min_price), float(max_price))
+    return _per_category(product_listing_query, categories, price_range, after, limit)
+
+# Extract the secure function without the decorator to make it visible to SonarQube
+def secure_product_query(category=None, min_price=None, max_price=None, limit=DEFAULT_PAGE_SIZE, after=None):
+    """
+    This function demonstrates proper SQL parameterization.
+    SonarQube should be able to analyze this more easily.
+    
+    Products come back in (price, id) order, one page at a time. Passing the
+    returned keyset back as after seeks straight past it, so every page costs
+    O(limit) no matter how deep the client pages (unlike OFFSET), also across
+    several categories (at most limit + 1 rows are read per category).
+    
+    Args:
+        category: Category name or list of category names
+    
+    Returns:
+        Tuple of (products on this page, [price, id] of its last product or None on the last page)
+    """
+    queries = secure_product_listing_queries(category, min_price, max_price, limit, after)
+    
+    with db_pool.connection() as conn:
+        pages = [query.execute(conn, cache=query_cache) for query in queries]
+    return _paginate(_merge_pages(pages, limit, ('price', 'id')), limit, ('price', 'id'))
+
+# This is an alternative implementation paginating on id alone
+def secure_product_query_alt(category=None, limit=DEFAULT_PAGE_SIZE, after=None):
+    """
+    Alternative implementation returning products in id order
+    
+    Returns:
+        Tuple of (products on this page, [id] of its last product or None on the last page)
+    """
+    after_id = after[0] if after is not None else 0
+    with db_pool.connection() as conn:
+        # Using the query builder with proper parameterization
+        queries = _per_category(product_id_listing_query, _category_list(category), after_id, limit)
+        pages = [query.execute(conn, cache=query_cache) for query in queries]
+    return _paginate(_merge_pages(pages, limit, ('id',)), limit, ('id',))
+
+def stream_product_page(queries, limit, key_columns, mimetype):
+    """
+    Stream one page of listing queries built with limit + 1 rows
+    
+    Rows are encoded as they come off the cursors (merged in listing order when
+    there are several queries), so memory and time to first byte do not grow
+    with the page size. The pooled connection is held until the response has
+    been sent (or the client goes away).
+    
+    Returns:
+        Streamed response: {"products": [...], "next_cursor": ...} for JSON,
+        or one product per line followed by a {"next_cursor": ...} line
+        (unless this is the last page) for NDJSON
+    """
+    key_indexes = [PRODUCT_COLUMNS.index(column) for column in key_columns]
+    page = {'last_key': None}
+    
+    def batches():
+        with db_pool.connection() as conn, ExitStack() as stack:
+            sources = [
+                chain.from_iterable(stack.enter_context(closing(query.iter_batches(conn, row_format='tuple'))))
+                for query in queries
+            ]
+            rows = sources[0] if len(sources) == 1 else heapq.merge(*sources, key=itemgetter(*key_indexes))
+            remaining, last_row = limit, None
+            while remaining:
+                batch = list(islice(rows, min(remaining, DEFAULT_BATCH_SIZE)))
+                if not batch:
+                    return
+                remaining -= len(batch)
+                last_row = batch[-1]
+                yield batch
+            # The extra row only tells that there is another page
+            if next(rows, None) is not None:
+                page['last_key'] = [last_row[index] for index in key_indexes]
+    
+    return stream_rows_response(
+        batches(), PRODUCT_COLUMNS, mimetype, key='products',
+        trailer=lambda: {'next_cursor': encode_page_cursor(page['last_key'])}
+    )
+
+def parse_page_args(args, key_types):
     """
-    Alternative implementation using direct_query_safe
+    Read the limit and after parameters of a paginated request
+    
+    Args:
+        args: Request query arguments
+        key_types: Expected type (or tuple of types) of each keyset value in the cursor
+    
+    Returns:
+        Tuple of (page size capped at MAX_PAGE_SIZE, decoded keyset or None)
+    
+    Raises:
+        ValueError: If limit is not a positive integer or after is not a valid cursor
     """
-    conn = connect_to_db(DB_PATH)
+    limit = args.get('limit', DEFAULT_PAGE_SIZE)
     try:
-        if category:
-            # Using the secure version with proper parameterization
-            results = direct_query_safe(conn, 'products', 'category', '=', category)
-        else:
-            results = execute_safe_query(conn, "SELECT * FROM products", ())
-        return results
-    finally:
-        conn.close()
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid limit '{limit}'")
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    limit = min(limit, MAX_PAGE_SIZE)
+    
+    after = args.get('after')
+    if not after:
+        return limit, None
+    try:
+        keyset = json.loads(base64.urlsafe_b64decode(after + '=' * (-len(after) % 4)))
+    except ValueError:
+        raise ValueError("Invalid pagination cursor")
+    if (not isinstance(keyset, list) or len(keyset) != len(key_types)
+            or not all(isinstance(value, key_type) and not isinstance(value, bool)
+                       for value, key_type in zip(keyset, key_types))):
+        raise ValueError("Invalid pagination cursor")
+    return limit, keyset
+
+def encode_page_cursor(keyset):
+    """Encode the keyset of the last row on a page as an opaque next_cursor value"""
+    if keyset is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(keyset).encode()).decode().rstrip('=')
+
+def _response_format():
+    """Representation of a listing response selected by the Accept header"""
+    return negotiate_mimetype(request.accept_mimetypes)
 
 # New route that uses the secure function
-@app.route('/api/products', methods=['GET'])
+@api.route('/api/products', methods=['GET'])
+@response_cache.cached(variant=_response_format)
 def api_get_products():
     """Route that calls the secure function"""
-    category = request.args.get('category')
+    categories = request.args.getlist('category')
     min_price = request.args.get('min_price')
     max_price = request.args.get('max_price')
     
     try:
-        results = secure_product_query(category, min_price, max_price)
-        return jsonify({"products": results})
+        limit, after = parse_page_args(request.args, ((int, float), int))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        mimetype = negotiate_mimetype(request.accept_mimetypes)
+        if mimetype != JSON_MIMETYPE or limit > MAX_BUFFERED_PAGE_SIZE:
+            queries = secure_product_listing_queries(categories, min_price, max_price, limit, after)
+            return stream_product_page(queries, limit, ('price', 'id'), mimetype)
+        results, last_key = secure_product_query(categories, min_price, max_price, limit, after)
+        return jsonify({"products": results, "next_cursor": encode_page_cursor(last_key)})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/products/by-category', methods=['GET'])
+@api.route('/api/products/by-category', methods=['GET'])
+@response_cache.cached(variant=_response_format)
 def api_get_products_by_category():
     """Route that calls the alternative secure function"""
-    category = request.args.get('category')
+    categories = request.args.getlist('category')
     
     try:
-        results = secure_product_query_alt(category)
-        return jsonify({"products": results})
+        limit, after = parse_page_args(request.args, (int,))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        mimetype = negotiate_mimetype(request.accept_mimetypes)
+        if mimetype != JSON_MIMETYPE or limit > MAX_BUFFERED_PAGE_SIZE:
+            queries = _per_category(product_id_listing_query, _category_list(categories), after[0] if after else 0,
+                                    limit)
+            return stream_product_page(queries, limit, ('id',), mimetype)
+        results, last_key = secure_product_query_alt(categories, limit, after)
+        return jsonify({"products": results, "next_cursor": encode_page_cursor(last_key)})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/health')
+@api.route('/api/products', methods=['POST'])
+def api_create_product():
+    """Route that adds a product through the write queue"""
+    data = request.get_json(silent=True) or {}
+    try:
+        product = (str(data['name']), str(data['category']), float(data['price']), int(data.get('inventory', 0)))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "name, category and a numeric price are required"}), 400
+    
+    try:
+        # Parameterized insert, committed together with any other queued writes
+        query = "INSERT INTO products (name, category, price, inventory) VALUES (?, ?, ?, ?)"
+        result = db_router.write(query, product).result(timeout=WRITE_TIMEOUT)
+        # Don't let clients revalidate stale listings until the watcher notices the commit
+        response_cache.invalidate()
+        return jsonify({"id": result.lastrowid}), 201
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/metrics/queries')
+def query_metrics_report():
+    """Per-statement query metrics recorded by sql_utils"""
+    return jsonify(query_metrics.snapshot())
+
+@api.route('/metrics/cache')
+def cache_metrics_report():
+    """Hit/miss counters of the query and response caches"""
+    return jsonify({"query_cache": query_cache.stats(), "response_cache": response_cache.stats()})
+
+@api.route('/health')
 def health_check():
     """Health check endpoint"""
     return jsonify({"status": "ok"})
 
+def create_app():
+    """
+    Build the Flask application
+    
+    The database pools, write queue and caches are module-level and fork-aware:
+    a worker process forked by serve_prefork() opens its own SQLite handles.
+    """
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(api)
+    
+    # Per-route request metrics on /metrics. Set PROFILE_DIR to keep cProfiles of
+    # sampled requests slower than PROFILE_THRESHOLD seconds.
+    flask_app.extensions['request_metrics'] = install_request_metrics(
+        flask_app,
+        exporters=[query_metrics.to_prometheus],
+        profile_dir=os.environ.get('PROFILE_DIR'),
+        profile_sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', '0.01')),
+        profile_threshold=float(os.environ.get('PROFILE_THRESHOLD', '0.5'))
+    )
+    return flask_app
+
+app = create_app()
+
 if __name__ == '__main__':
-    initialize_database()
-    app.run(debug=True, port=5001)
+    # WEB_WORKERS=N serves with N prefork worker processes (0 = one per CPU)
+    # instead of the single-process development server
+    if 'WEB_WORKERS' in os.environ:
+        serve_prefork(create_app, port=5001, workers=int(os.environ['WEB_WORKERS']) or None,
+                      before_fork=initialize_database)
+    else:
+        initialize_database()
+        app.run(debug=True, port=5001)
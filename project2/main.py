@@ -4,28 +4,145 @@ Project 2: Data Analysis Example
 import sys
 import os
 import json
+import sqlite3
+from itertools import compress
 
 # Add the parent directory to sys.path to import the lib package
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from lib.utils import calculate_average, process_user_input
-from lib.data_processing import transform_dict, filter_data
+from lib.utils import process_user_input
+from lib.data_processing import filter_data, reduce_by_key, Mean
+from lib.sql_utils import _validate_identifier, execute_safe_query
 
-def analyze_product_data(products):
-    """Analyze product data"""
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, the pure-Python engine is used without it
+    np = None
+
+# Below this many products the NumPy engine's setup costs more than it saves
+VECTORIZE_MIN_PRODUCTS = 10000
+
+def analyze_product_data(products, engine="auto", table_name="products"):
+    """
+    Analyze product data
+    
+    Args:
+        products: List of product dictionaries with 'price' and 'category' keys,
+                  or a SQLite connection holding them in table_name
+        engine: "sql" to run the analysis inside SQLite (connections only), "numpy" for
+                the vectorized engine, "python" for the pure-Python one, or "auto" to
+                pick "sql" for connections and NumPy for large lists when it is installed
+        table_name: Products table used by the SQL engine
+    """
+    in_database = isinstance(products, sqlite3.Connection)
+    if engine == "sql" or (engine == "auto" and in_database):
+        if not in_database:
+            raise ValueError("The sql engine needs a SQLite connection instead of a product list")
+        return _analyze_product_data_sql(products, table_name)
+    if in_database:
+        raise ValueError(f"The {engine} engine needs a product list; use the sql engine for connections")
+    
+    if engine == "auto":
+        use_numpy = np is not None and len(products) >= VECTORIZE_MIN_PRODUCTS
+    elif engine == "numpy":
+        if np is None:
+            raise ImportError("The numpy engine requires NumPy to be installed")
+        use_numpy = True
+    elif engine == "python":
+        use_numpy = False
+    else:
+        raise ValueError(f"Unknown engine '{engine}'. Use one of: auto, sql, numpy, python")
+    
+    if use_numpy:
+        return _analyze_product_data_numpy(products)
+    return _analyze_product_data_python(products)
+
+def _analyze_product_data_sql(db_conn, table_name):
+    """
+    In-database engine: SQLite computes the averages with GROUP BY and picks the
+    premium products with AVG() OVER (PARTITION BY category), so only the results
+    are transferred to Python instead of every product.
+    
+    Categories are listed in order of first appearance and premium products in
+    table order, matching the in-memory engines run over the table's rows; a NULL
+    category is its own group keyed None, as in those engines. Table order is
+    rowid order, so tables declared WITHOUT ROWID (and views) are rejected.
+    """
+    _validate_identifier(table_name)
+    try:
+        db_conn.execute(f"SELECT rowid FROM {table_name} LIMIT 0")
+    except sqlite3.OperationalError as e:
+        if "rowid" not in str(e):
+            raise
+        raise ValueError(f"The sql engine needs a rowid table; '{table_name}' has no rowid to order by") from e
+    
+    averages = execute_safe_query(
+        db_conn,
+        f"SELECT category, AVG(price) AS average_price "
+        f"FROM {table_name} WHERE price > 0 GROUP BY category ORDER BY MIN(rowid)",
+        (),
+        row_format="tuple"
+    )
+    avg_prices = dict(averages)
+    
+    premium_products = execute_safe_query(
+        db_conn,
+        f"SELECT * FROM (SELECT *, rowid AS _row, AVG(price) OVER (PARTITION BY category) AS _category_average "
+        f"FROM {table_name} WHERE price > 0) WHERE price > _category_average ORDER BY _row",
+        ()
+    )
+    for product in premium_products:
+        del product['_row'], product['_category_average']
+    
+    return {
+        "average_by_category": avg_prices,
+        "premium_products": premium_products
+    }
+
+def _analyze_product_data_numpy(products):
+    """
+    Vectorized engine: one comprehension per column pulls prices and categories out
+    of the product dicts, then grouping, means and the premium filter run in NumPy.
+    
+    Prices are summed in input order, like calculate_average does, so the results
+    match the pure-Python engine.
+    """
+    prices = np.array([p.get('price', 0) for p in products], dtype=np.float64)
+    valid_mask = prices > 0
+    valid = np.flatnonzero(valid_mask)
+    valid_prices = prices[valid]
+    
+    # Factorize categories in order of first appearance, matching the dict order of the Python engine
+    categories = list(compress((p.get('category', 'uncategorized') for p in products), valid_mask.tolist()))
+    category_codes = {category: code for code, category in enumerate(dict.fromkeys(categories))}
+    codes = np.fromiter(map(category_codes.__getitem__, categories), dtype=np.intp, count=len(categories))
+    
+    # Group means via bincount: per-category sums divided by per-category counts
+    sums = np.bincount(codes, weights=valid_prices, minlength=len(category_codes))
+    counts = np.bincount(codes, minlength=len(category_codes))
+    means = sums / np.maximum(counts, 1)
+    avg_prices = {category: float(means[code]) for category, code in category_codes.items()}
+    
+    # Products above the average price of their own category
+    premium_indexes = valid[valid_prices > means[codes]]
+    premium_products = list(map(products.__getitem__, premium_indexes.tolist()))
+    
+    return {
+        "average_by_category": avg_prices,
+        "premium_products": premium_products
+    }
+
+def _analyze_product_data_python(products):
+    """Pure-Python engine, used when NumPy is unavailable or the input is small"""
     # Filter out products with no price or 0 price
     valid_products = filter_data(products, lambda p: p.get('price', 0) > 0)
     
-    # Calculate average price by category
-    by_category = {}
-    for product in valid_products:
-        category = product.get('category', 'uncategorized')
-        if category not in by_category:
-            by_category[category] = []
-        by_category[category].append(product['price'])
-    
-    # Transform to get average prices
-    avg_prices = transform_dict(by_category, calculate_average)
+    # Calculate average price by category with a running sum/count per category
+    avg_prices = reduce_by_key(
+        valid_products,
+        lambda p: p.get('category', 'uncategorized'),
+        Mean(lambda p: p['price'])
+    )
     
     # Find products above average price in their category
     premium_products = filter_data(
@@ -3,20 +3,40 @@ Project2: Application demonstrating SQL injection vulnerability
 """
 import sys
 import os
-from flask import Flask, request, jsonify
+import time
+from contextlib import closing
+from flask import Blueprint, Flask, request, jsonify
 
 # Add the lib directory to the path so we can import sql_utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from lib.sql_utils import connect_to_db, direct_query_unsafe
+from lib.sql_utils import (
+    connect_to_db, direct_query_unsafe, ConnectionPool,
+    QueryMetrics, set_query_metrics
+)
+from lib.json_stream import negotiate_mimetype, stream_rows_response
+from lib.metrics import install_request_metrics
+from lib.serving import serve_prefork
 
-app = Flask(__name__)
+# Routes live on a blueprint so create_app() can build a fresh app in every worker process
+api = Blueprint('api', __name__)
 
-# Connect to database
-DB_PATH = os.path.join(os.path.dirname(__file__), 'data.db')
+# Connect to database (VULNERABLE_APP_DB overrides the location, e.g. for benchmarks)
+DB_PATH = os.environ.get('VULNERABLE_APP_DB', os.path.join(os.path.dirname(__file__), 'data.db'))
+
+# Record latency, rows and slow queries for every query run through sql_utils
+query_metrics = QueryMetrics(slow_query_threshold=0.1)
+set_query_metrics(query_metrics)
+
+# Reuse connections across requests instead of opening the database every time;
+# the read-heavy profile puts the file in WAL mode so readers never wait on a writer
+db_pool = ConnectionPool(DB_PATH, on_connect=query_metrics.instrument_connection, profile='read_heavy')
+
+# Rows read from the cursor per chunk of a streamed search response
+STREAM_BATCH_SIZE = 1000
 
 def initialize_database():
     """Initialize the database with sample data"""
-    conn = connect_to_db(DB_PATH)
+    conn = connect_to_db(DB_PATH, profile='write_heavy')
     cursor = conn.cursor()
     
     # Create users table
@@ -51,39 +71,91 @@ def vulnerable_sql_function(search_term):
     """
     This function contains a direct SQL injection vulnerability.
     SonarQube should be able to detect this more easily.
+    
+    Buffered variant of vulnerable_sql_stream (which runs the query and records
+    its metrics): returns every matching user as a dictionary.
     """
-    conn = connect_to_db(DB_PATH)
-    try:
+    with closing(vulnerable_sql_stream(search_term)) as batches:
+        column_names = next(batches)
+        return [dict(zip(column_names, row)) for batch in batches for row in batch]
+
+def vulnerable_sql_stream(search_term):
+    """
+    Streaming search with a direct SQL injection vulnerability.
+    
+    Yields the column names first, then batches of row tuples as they come off
+    the cursor, holding a pooled connection until the generator is closed.
+    """
+    with db_pool.connection() as conn:
         # CRITICAL VULNERABILITY: Direct user input in SQL query without sanitization
         query = f"SELECT * FROM users WHERE {search_term}"
         cursor = conn.cursor()
-        cursor.execute(query)  # Direct SQL injection vulnerability
-        
-        column_names = [description[0] for description in cursor.description] if cursor.description else []
-        
-        results = []
-        for row in cursor.fetchall():
-            results.append(dict(zip(column_names, row)))
-        
-        return results
-    finally:
-        conn.close()
+        try:
+            started = time.perf_counter()
+            cursor.execute(query)  # Direct SQL injection vulnerability
+            executed = time.perf_counter()
+            yield [description[0] for description in cursor.description] if cursor.description else []
+            
+            rows = 0
+            fetch_seconds = 0.0
+            while True:
+                fetch_started = time.perf_counter()
+                batch = cursor.fetchmany(STREAM_BATCH_SIZE)
+                fetch_seconds += time.perf_counter() - fetch_started
+                if not batch:
+                    break
+                rows += len(batch)
+                yield batch
+            query_metrics.record(conn, query, (), executed - started, fetch_seconds, rows)
+        finally:
+            cursor.close()
 
 # New route that uses the vulnerable function
-@app.route('/api/users/search', methods=['GET'])
+@api.route('/api/users/search', methods=['GET'])
 def api_search_users():
     """Route that calls the vulnerable function"""
     search_condition = request.args.get('condition', '')
     try:
-        results = vulnerable_sql_function(search_condition)
-        return jsonify({"users": results})
+        # Results are streamed as they are read: a JSON document, or NDJSON if the client asks for it
+        batches = vulnerable_sql_stream(search_condition)
+        columns = next(batches)
+        return stream_rows_response(batches, columns, negotiate_mimetype(request.accept_mimetypes), key='users')
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/health')
+@api.route('/metrics/queries')
+def query_metrics_report():
+    """Per-statement query metrics recorded by sql_utils"""
+    return jsonify(query_metrics.snapshot())
+
+@api.route('/health')
 def health_check():
     return jsonify({"status": "ok"})
 
+def create_app():
+    """Build the Flask application (serve_prefork() calls this in every worker process)"""
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(api)
+    
+    # Per-route request metrics on /metrics. Set PROFILE_DIR to keep cProfiles of
+    # sampled requests slower than PROFILE_THRESHOLD seconds.
+    flask_app.extensions['request_metrics'] = install_request_metrics(
+        flask_app,
+        exporters=[query_metrics.to_prometheus],
+        profile_dir=os.environ.get('PROFILE_DIR'),
+        profile_sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', '0.01')),
+        profile_threshold=float(os.environ.get('PROFILE_THRESHOLD', '0.5'))
+    )
+    return flask_app
+
+app = create_app()
+
 if __name__ == '__main__':
-    initialize_database()
-    app.run(debug=True, port=5002)
+    # WEB_WORKERS=N serves with N prefork worker processes (0 = one per CPU)
+    # instead of the single-process development server
+    if 'WEB_WORKERS' in os.environ:
+        serve_prefork(create_app, port=5002, workers=int(os.environ['WEB_WORKERS']) or None,
+                      before_fork=initialize_database)
+    else:
+        initialize_database()
+        app.run(debug=True, port=5002)
@@ -0,0 +1,81 @@
+import sqlite3
+
+import pytest
+
+from lib.sql_utils import WriteQueue
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "writes.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY)")
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def write_queue(db_path):
+    write_queue = WriteQueue(db_path, max_batch_delay=0.2)
+    yield write_queue
+    write_queue.close()
+
+
+def stored_ids(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in conn.execute("SELECT id FROM items ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def submit_batch(write_queue, operations):
+    """Submit operations within max_batch_delay, so that they are committed as one batch"""
+    batches = write_queue.stats()["batches"]
+    futures = [write_queue.submit(operation) for operation in operations]
+    for future in futures:
+        future.exception(timeout=5)
+    assert write_queue.stats()["batches"] == batches + 1
+    return futures
+
+
+def insert(item_id):
+    return lambda conn: conn.execute("INSERT INTO items (id) VALUES (?)", (item_id,)).rowcount
+
+
+@pytest.mark.parametrize("end_transaction", [
+    lambda conn: conn.commit(),
+    lambda conn: conn.rollback(),
+    lambda conn: conn.execute("COMMIT"),
+    lambda conn: conn.executescript("INSERT INTO items (id) VALUES (300); COMMIT;"),
+])
+def test_operation_ending_the_transaction_fails_alone(db_path, write_queue, end_transaction):
+    def operation(conn):
+        insert(250)(conn)
+        end_transaction(conn)
+
+    futures = submit_batch(write_queue, [insert(200), insert(201), operation, insert(202)])
+
+    assert futures[0].result(timeout=5) == 1
+    assert futures[1].result(timeout=5) == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        futures[2].result(timeout=5)
+    assert futures[3].result(timeout=5) == 1
+    assert stored_ids(db_path) == [200, 201, 202]
+
+
+def test_trigger_rolling_back_fails_the_whole_batch(db_path, write_queue):
+    write_queue.execute("""
+        CREATE TRIGGER reject_999 BEFORE INSERT ON items WHEN NEW.id = 999
+        BEGIN SELECT RAISE(ROLLBACK, 'rejected'); END
+    """).result(timeout=5)
+
+    futures = submit_batch(write_queue, [insert(200), insert(999), insert(201)])
+
+    for future in futures:
+        with pytest.raises(sqlite3.Error):
+            future.result(timeout=5)
+    assert stored_ids(db_path) == []
+    assert write_queue.execute("INSERT INTO items (id) VALUES (203)").result(timeout=5).rowcount == 1
+    assert stored_ids(db_path) == [203]